@@ -1,11 +1,41 @@
 import streamlit as st
+import generation_actions
+from config import get_generation_service_url
+from dedup_index import get_dedup_index, session_scope
+from generation_jobs import JobRegistry, JOB_POLL_INTERVAL
+from llm_client import deadline, ACTION_DEADLINE, create_client, set_client
+from metrics import profiled, span
 from reference_loader import load_reference_questions
-from question_generator import (
-    create_question,
-    generate_meaning_test,
-    generate_contextual_question,
-    generate_contextual_test
-)
+from question_pool import QuestionPool, PoolRefiller, MEANING_TEST, CONTEXTUAL
+from service_client import GenerationServiceClient
+
+
+@st.cache_resource
+def get_llm_client():
+    """Pooled OpenAI client built once per server process from env or Streamlit secrets"""
+    return set_client(create_client())
+
+
+@st.cache_resource
+def get_question_pool():
+    """One question bank and refill worker per server process, shared by every session"""
+    pool = QuestionPool()
+    refiller = PoolRefiller(pool)
+    refiller.start()
+    return pool, refiller
+
+
+@st.cache_resource
+def get_generation_service(url):
+    """Thin client for generation_service; the app then does no LLM work itself"""
+    return GenerationServiceClient(url)
+
+
+@st.cache_resource
+def get_job_registry():
+    """Generation jobs of every session, kept across reruns and reconnects"""
+    return JobRegistry()
+
 
 grades = ["الصف السابع والثامن"]
 skills = {"الأسئلة اللفظية": "الأسئلة_اللفظية"}
@@ -29,69 +59,202 @@ selected_grade = grades[0]
 selected_skill_label = list(skills.keys())[0]
 selected_skill_folder = skills[selected_skill_label]
 
+grade_folder = "الصف_السابع_والثامن"
+jobs = get_job_registry()
+service_url = get_generation_service_url()
+service = pool = refiller = None
+if service_url:
+    # Generation, the question pool and its refill worker all live in the service
+    service = get_generation_service(service_url)
+else:
+    get_llm_client()
+    pool, refiller = get_question_pool()
+    refiller.watch(grade_folder, selected_skill_folder, MEANING_TEST, selected_grade)
+    refiller.watch(grade_folder, selected_skill_folder, CONTEXTUAL, selected_grade)
+
+# Words and sentences are not repeated for a teacher (?teacher=...) or, without one, for this session
+if "dedup_scope" not in st.session_state:
+    st.session_state["dedup_scope"] = st.query_params.get("teacher") or session_scope()
+dedup_scope = st.session_state["dedup_scope"]
+# With a service the index lives there, keyed by the same scope
+dedup = None if service else get_dedup_index(dedup_scope)
+
+
+NO_REFERENCES = "لا توجد أسئلة مرجعية في هذه المرحلة/المهارة. تأكد من وجود الملفات في المسار الصحيح."
+
+
+def _references(job):
+    reference_questions = load_reference_questions(grade_folder, selected_skill_folder, progress=job.report)
+    if not reference_questions:
+        job.notify("error", NO_REFERENCES)
+    return reference_questions
+
+
+def run_word_meaning(job, main_word):
+    with deadline(ACTION_DEADLINE), span("action", question_type=job.kind), profiled("action"):
+        if service:
+            question, answer, msg = service.word_meaning(main_word)
+        else:
+            reference_questions = _references(job)
+            if not reference_questions:
+                return
+            question, answer, msg = generation_actions.word_meaning(
+                main_word, reference_questions, selected_grade, grade_folder, selected_skill_folder, pool, refiller
+            )
+        if msg:
+            job.notify("warning", msg)
+        if question and answer:
+            job.add((question, answer, msg))
+
+
+def run_meaning_test(job, num_questions):
+    with deadline(ACTION_DEADLINE), span("action", question_type=job.kind), profiled("action"):
+        if service:
+            items = service.meaning_test(num_questions, dedup_scope)
+        else:
+            reference_questions = _references(job)
+            if not reference_questions:
+                return
+            # Pooled questions are added at once; generated ones as each is ready
+            items = generation_actions.iter_meaning_test_items(
+                num_questions, reference_questions, selected_grade, grade_folder, selected_skill_folder,
+                dedup, pool, refiller,
+            )
+        count = 0
+        for item in items:
+            job.add(item)
+            count += 1
+        if not count:
+            job.notify("error", "تعذر توليد عدد كافٍ من الأسئلة بمعنى صحيح. حاول مجددًا أو قلل عدد الأسئلة.")
+        elif count < num_questions:
+            job.notify("warning", f"تم توليد {count} من أصل {num_questions} أسئلة ضمن الوقت المحدد.")
+
+
+def run_contextual(job, num_questions):
+    with deadline(ACTION_DEADLINE), span("action", question_type=job.kind), profiled("action"):
+        if service:
+            items = service.contextual_test(num_questions, dedup_scope)
+        else:
+            reference_questions = _references(job)
+            if not reference_questions:
+                return
+            # A single question shows the model's text while it streams, then the formatted question
+            items = generation_actions.iter_contextual_items(
+                num_questions, reference_questions, selected_grade, grade_folder, selected_skill_folder,
+                dedup, pool, refiller, on_token=job.set_preview,
+            )
+        count = 0
+        for item in items:
+            job.add(item)
+            count += 1
+        if num_questions == 1:
+            if not count:
+                job.notify("error", "تعذر توليد السؤال. حاول مجددًا.")
+        elif not count:
+            job.notify("error", "تعذر توليد عدد كافٍ من الأسئلة السياقية. حاول مجددًا أو قلل العدد.")
+        elif count < num_questions:
+            job.notify("warning", f"تم توليد {count} من أصل {num_questions} أسئلة ضمن الوقت المحدد.")
+
+
+def render_word_meaning(items):
+    for question, answer, msg in items:
+        st.text(question)  # Use st.text to preserve line breaks
+        st.success(f"الإجابة الصحيحة: {answer}")
+
+
+def render_meaning_test(items):
+    for idx, (question, answer, msg) in enumerate(items, 1):
+        if idx > 1:
+            st.markdown("---")
+        if msg:
+            st.warning(f"سؤال {idx}: {msg}")
+        st.markdown(f"**السؤال {idx}:**")
+        st.text(question)  # Use st.text to preserve line breaks
+        st.success(f"الإجابة الصحيحة: {answer}")
+
+
+def render_contextual(items):
+    numbered = len(items) > 1
+    for idx, (question, answer_line) in enumerate(items, 1):
+        if numbered:
+            if idx > 1:
+                st.markdown("---")
+            st.markdown(f"**السؤال {idx}:**")
+        st.text(question)  # Use st.text to preserve line breaks
+        if answer_line:
+            st.success(answer_line)
+
+
+def render_job(snapshot, render_items, spinner_text):
+    progress = snapshot["progress"]
+    if progress:
+        done, total = progress
+        st.progress(done / total, text=f"يتم استخراج الملفات المرجعية... ({done}/{total})")
+    render_items(snapshot["items"])
+    if snapshot["status"] == "running":
+        if snapshot["preview"]:
+            st.text(snapshot["preview"])
+        st.caption(spinner_text)
+    for level, text in snapshot["notices"]:
+        getattr(st, level)(text)
+
+
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def follow_job(job_id, render_items, spinner_text):
+    """Re-render a running job until it finishes, then rerun the page once to drop the polling"""
+    job = jobs.get(job_id)
+    if job is None:
+        return
+    snapshot = job.snapshot()
+    render_job(snapshot, render_items, spinner_text)
+    if snapshot["status"] != "running":
+        st.rerun()
+
+
+def show_job(render_items, spinner_text):
+    """Render this question type's latest job from the cache, following it while it runs"""
+    job = jobs.get(st.session_state["jobs"].get(question_type))
+    if job is None:
+        return
+    if job.running:
+        follow_job(job.id, render_items, spinner_text)
+    else:
+        render_job(job.snapshot(), render_items, spinner_text)
+
+
+def start_job(params, target, *args):
+    """Run target in the background and remember the job for this session's reruns
+
+    Clicking again while the same request is still running reattaches to it instead of starting over.
+    """
+    current = jobs.get(st.session_state["jobs"].get(question_type))
+    if current is not None and current.running and current.params == params:
+        return
+    job = jobs.start(question_type, params, lambda job: target(job, *args))
+    st.session_state["jobs"][question_type] = job.id
+
+
+# Latest job id per question type; the jobs themselves live in the process-wide registry
+if "jobs" not in st.session_state:
+    st.session_state["jobs"] = {}
+
 if question_type == "معنى الكلمة":
     main_word = st.text_input("أدخل الكلمة الرئيسية (بالعربية)")
     if st.button("توليد سؤال"):
-        with st.spinner("يتم توليد السؤال..."):
-            grade_folder = "الصف_السابع_والثامن"
-            reference_questions = load_reference_questions(grade_folder, selected_skill_folder)
-            if not reference_questions:
-                st.error("لا توجد أسئلة مرجعية في هذه المرحلة/المهارة. تأكد من وجود الملفات في المسار الصحيح.")
-            elif not main_word.strip():
-                st.error("يرجى إدخال كلمة رئيسية.")
-            else:
-                question, answer, msg = create_question(main_word, reference_questions, selected_grade)
-                if msg:
-                    st.warning(msg)
-                st.text(question)  # Use st.text to preserve line breaks
-                st.success(f"الإجابة الصحيحة: {answer}")
+        if not main_word.strip():
+            st.error("يرجى إدخال كلمة رئيسية.")
+        else:
+            start_job({"main_word": main_word.strip()}, run_word_meaning, main_word.strip())
+    show_job(render_word_meaning, "يتم توليد السؤال...")
 
 elif question_type == "اختبار معاني الكلمات (تلقائي)":
     num_questions = st.slider("عدد الأسئلة في الاختبار", 1, 5, 3)
     if st.button("توليد اختبار"):
-        with st.spinner("يتم توليد الاختبار..."):
-            grade_folder = "الصف_السابع_والثامن"
-            reference_questions = load_reference_questions(grade_folder, selected_skill_folder)
-            if not reference_questions:
-                st.error("لا توجد أسئلة مرجعية في هذه المرحلة/المهارة. تأكد من وجود الملفات في المسار الصحيح.")
-            else:
-                test = generate_meaning_test(num_questions, reference_questions, selected_grade)
-                if not test:
-                    st.error("تعذر توليد عدد كافٍ من الأسئلة بمعنى صحيح. حاول مجددًا أو قلل عدد الأسئلة.")
-                for idx, (question, answer, msg) in enumerate(test, 1):
-                    if msg:
-                        st.warning(f"سؤال {idx}: {msg}")
-                    st.markdown(f"**السؤال {idx}:**")
-                    st.text(question)  # Use st.text to preserve line breaks
-                    st.success(f"الإجابة الصحيحة: {answer}")
-                    if idx < len(test):
-                        st.markdown("---")
+        start_job({"num_questions": num_questions}, run_meaning_test, num_questions)
+    show_job(render_meaning_test, "يتم توليد الاختبار...")
 
 elif question_type == "معنى الكلمة حسب السياق":
     num_questions = st.slider("عدد الأسئلة في الاختبار", 1, 5, 1)
     if st.button("توليد سؤال/اختبار"):
-        with st.spinner("يتم توليد السؤال..."):
-            grade_folder = "الصف_السابع_والثامن"
-            reference_questions = load_reference_questions(grade_folder, selected_skill_folder)
-            if not reference_questions:
-                st.error("لا توجد أسئلة مرجعية في هذه المرحلة/المهارة. تأكد من وجود الملفات في المسار الصحيح.")
-            else:
-                if num_questions == 1:
-                    question, answer_line = generate_contextual_question(reference_questions, selected_grade)
-                    if question and answer_line:
-                        st.text(question)  # Use st.text to preserve line breaks
-                        st.success(answer_line)
-                    else:
-                        st.error("تعذر توليد السؤال. حاول مجددًا.")
-                else:
-                    test = generate_contextual_test(num_questions, reference_questions, selected_grade)
-                    if not test:
-                        st.error("تعذر توليد عدد كافٍ من الأسئلة السياقية. حاول مجددًا أو قلل العدد.")
-                    else:
-                        for idx, (question, answer_line) in enumerate(test, 1):
-                            st.markdown(f"**السؤال {idx}:**")
-                            st.text(question)  # Use st.text to preserve line breaks
-                            if answer_line:
-                                st.success(answer_line)
-                            if idx < len(test):
-                                st.markdown("---")
+        start_job({"num_questions": num_questions}, run_contextual, num_questions)
+    show_job(render_contextual, "يتم توليد السؤال...")
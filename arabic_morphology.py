@@ -0,0 +1,119 @@
+from functools import lru_cache
+from arabic_text import DIACRITICS
+
+# Morphological patterns (أوزان); ف ع ل mark the root letters, every other letter is literal.
+# Hamza-seated alifs are written as bare ا because words are normalized before matching.
+PATTERNS = [
+    "فعل", "فعال", "فعيل", "فعول", "فاعل", "فعلة", "فعلى", "فعلاء", "فعلان",
+    "فعالة", "فعيلة", "فعولة", "فاعلة", "فواعل", "فعائل",
+    "افعل", "افعال", "افعلة", "يفعل", "تفعل", "نفعل",
+    "مفعل", "مفعلة", "مفعال", "مفعول", "مفاعل", "مفاعيل", "مفاعلة", "مفعولة",
+    "تفعيل", "تفعلة", "تفاعل", "تفعال", "تفاعيل",
+    "افتعل", "افتعال", "انفعل", "انفعال", "استفعل", "استفعال",
+    "مفتعل", "منفعل", "مستفعل", "متفاعل", "متفعل", "مفتعلة", "مستفعلة",
+    "يفتعل", "ينفعل", "يستفعل", "يتفاعل", "يتفعل",
+]
+
+DEFINITE_PREFIXES = ("وال", "فال", "بال", "كال", "ال", "لل")
+SUFFIXES = ("ات", "ون", "ين", "ان", "ها", "هم", "ة", "ه")
+
+# آ spells hamza + alif, so it counts as two letters (مآثر is مفاعل of أثر)
+_HAMZA = {"أ": "ا", "إ": "ا", "آ": "اا", "ٱ": "ا", "ؤ": "و", "ئ": "ي", "ى": "ي"}
+_HAMZA_FORMS = str.maketrans(_HAMZA)
+_NORMALIZE = str.maketrans({**dict.fromkeys(DIACRITICS), **_HAMZA})
+_WEAK = str.maketrans({"و": "ا", "ي": "ا"})
+
+
+def _compile(pattern):
+    pattern = pattern.translate(_HAMZA_FORMS)
+    literals = tuple((i, ch) for i, ch in enumerate(pattern) if ch not in "فعل")
+    root_positions = tuple(i for i, ch in enumerate(pattern) if ch in "فعل")
+    return pattern, literals, root_positions
+
+
+def _build_index(patterns):
+    index = {}
+    for pattern in dict.fromkeys(patterns):
+        index.setdefault(len(pattern), []).append(_compile(pattern))
+    # Patterns with more literal letters are more specific and win ties
+    for entries in index.values():
+        entries.sort(key=lambda entry: -len(entry[1]))
+    return index
+
+
+PATTERN_INDEX = _build_index(PATTERNS)
+
+
+def normalize_word(word):
+    """Strip tashkeel and tatweel and fold hamza seats and alif maqsura"""
+    return word.strip().translate(_NORMALIZE)
+
+
+def strip_definite(word):
+    for prefix in DEFINITE_PREFIXES:
+        if word.startswith(prefix) and len(word) - len(prefix) >= 2:
+            return word[len(prefix):]
+    return word
+
+
+def _stem_candidates(stem):
+    yield stem
+    for suffix in SUFFIXES:
+        if stem.endswith(suffix) and len(stem) - len(suffix) >= 3:
+            yield stem[:-len(suffix)]
+
+
+def _match(stem):
+    for pattern, literals, root_positions in PATTERN_INDEX.get(len(stem), ()):
+        if all(stem[i] == ch for i, ch in literals):
+            return "".join(stem[i] for i in root_positions), pattern
+    return None
+
+
+@lru_cache(maxsize=65536)
+def analyze(word):
+    """Return (root, pattern) for a word; pattern is None when no وزن matched"""
+    stem = strip_definite(normalize_word(word))
+    for candidate in _stem_candidates(stem):
+        found = _match(candidate)
+        if found:
+            return found
+    return stem, None
+
+
+def extract_root(word):
+    return analyze(word)[0]
+
+
+def word_pattern(word):
+    return analyze(word)[1]
+
+
+def roots_match(root1, root2):
+    """Compare roots treating the weak letters ا/و/ي as interchangeable (قال / قول)"""
+    if not root1 or not root2:
+        return False
+    return root1.translate(_WEAK) == root2.translate(_WEAK)
+
+
+def share_root(word1, word2):
+    return roots_match(extract_root(word1), extract_root(word2))
+
+
+def letter_count(word):
+    return len(strip_definite(normalize_word(word)))
+
+
+def pattern_consistency_order(words):
+    """Order words so those matching the first word's pattern, then its letter count, come first"""
+    if not words:
+        return []
+    first_pattern = word_pattern(words[0])
+    first_length = letter_count(words[0])
+
+    def rank(item):
+        index, word = item
+        same_pattern = first_pattern is not None and word_pattern(word) == first_pattern
+        return (not same_pattern, letter_count(word) != first_length, index)
+
+    return [words[0]] + [word for _, word in sorted(enumerate(words[1:]), key=rank)]
@@ -0,0 +1,160 @@
+"""Arabic normalization shared by every word and sentence comparison.
+
+All folding is done with precomputed str.translate tables, so a word is
+normalized in one pass over its characters:
+
+    strip_diacritics   tashkeel, Quranic marks and tatweel removed
+    normalize          ... plus أ/إ/آ/ٱ -> ا, ؤ -> و, ئ/ى -> ي, ة -> ه
+    compare_key        ... plus surrounding punctuation and a leading ال removed
+    letters_only       ... with everything but Arabic letters turned into single spaces
+
+python arabic_text.py runs the microbenchmarks against the code it replaced.
+"""
+import re
+from functools import lru_cache
+
+DEFINITE_ARTICLE = "ال"
+
+DIACRITICS = "".join(
+    chr(code)
+    for code in (*range(0x0610, 0x061B), *range(0x064B, 0x0660), 0x0670, *range(0x06D6, 0x06EE), 0x0640)
+)
+_FOLDS = {"أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا", "ؤ": "و", "ئ": "ي", "ى": "ي", "ة": "ه"}
+_PUNCTUATION = " \t\n.,،؛;:!?؟\"'«»()[]-–—_*"
+
+_STRIP_TABLE = str.maketrans("", "", DIACRITICS)
+_FOLD_TABLE = str.maketrans({**dict.fromkeys(DIACRITICS), **_FOLDS})
+
+
+class _LetterTable(dict):
+    """_FOLD_TABLE that also maps any other non-letter to a space, filled in as characters are seen"""
+
+    def __missing__(self, code):
+        value = code if 0x0621 <= code <= 0x064A else 0x20
+        self[code] = value
+        return value
+
+
+_LETTER_TABLE = _LetterTable(_FOLD_TABLE)
+
+_ARABIC_TOKEN = re.compile(r"[\u0621-\u063A\u0640-\u0652\u0670\u0671]+")
+# "أ) word", "ب- word" or "ج word"; a bare word starting with one of these letters is not a label
+_CHOICE_LABEL = re.compile(r"^([أ-د])(?:[\)\-]\s*|\s+)(.+)")
+
+
+def strip_diacritics(text):
+    return text.translate(_STRIP_TABLE)
+
+
+def normalize(text):
+    """Strip diacritics and tatweel and fold hamza seats, alif maqsura and ta marbuta"""
+    return text.translate(_FOLD_TABLE)
+
+
+def letters_only(text):
+    """normalize(text) with runs of anything but Arabic letters collapsed to one space"""
+    return " ".join(text.translate(_LETTER_TABLE).split())
+
+
+def arabic_tokens(text):
+    return _ARABIC_TOKEN.findall(text)
+
+
+def has_al(word):
+    return strip_diacritics(word.strip()).startswith(DEFINITE_ARTICLE)
+
+
+def strip_al(word):
+    word = word.strip()
+    return word[2:] if word.startswith(DEFINITE_ARTICLE) else word
+
+
+@lru_cache(maxsize=65536)
+def compare_key(word):
+    """Key under which two spellings of a word are the same word"""
+    key = normalize(word.strip(_PUNCTUATION))
+    if key.startswith(DEFINITE_ARTICLE) and len(key) > 3:
+        key = key[2:]
+    return key
+
+
+def same_word(word1, word2):
+    return compare_key(word1) == compare_key(word2)
+
+
+def contains_word(text, word):
+    """True if word's key occurs anywhere in the normalized text"""
+    key = compare_key(word)
+    return bool(key) and key in normalize(text)
+
+
+def without_word(words, word):
+    """words minus every spelling of word"""
+    key = compare_key(word)
+    return [w for w in words if compare_key(w) != key]
+
+
+def split_choice_label(choice):
+    """(letter, word) of a labelled choice such as "أ) الكرم", or (None, choice)"""
+    match = _CHOICE_LABEL.match(choice.strip())
+    if match:
+        return match.group(1), match.group(2).strip()
+    return None, choice.strip()
+
+
+def choice_words(choices):
+    return [split_choice_label(choice)[1] for choice in choices]
+
+
+def _benchmark(number=20000):
+    """Time the translate-table functions against the code they replaced
+
+    "before" is copied from the tree this module replaced: the baseline's
+    words_are_same and choice-label regex, and the regex normalizer that
+    arabic_morphology, reference_index and dedup_index used. compare_key's
+    cache is cleared on every run, so the comparison case measures
+    normalization, not cache hits.
+    """
+    import timeit
+    words = ["الْكَرَمُ", "أَسْرَعَ", "إِحْسَانٌ", "مُسْتَشْفَى", "الـمدرسة", "آمال", "شجاعة", "بَرَعَ"]
+    choices = ["أ) الكرم", "ب) البخل", "ج- الشجاعة", "د- الوفاء"]
+    sentence = "أَظْهَرَ الطَّالِبُ شَجَاعَةً كَبِيرَةً، عِنْدَمَا دَافَعَ عَنْ زَمِيلِهِ (في المدرسة)."
+    diacritics = re.compile(r"[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED\u0640]")
+    non_arabic = re.compile(r"[^ء-ي\s]+")
+    hamza = str.maketrans({"أ": "ا", "إ": "ا", "آ": "اا", "ٱ": "ا", "ؤ": "و", "ئ": "ي", "ى": "ي"})
+
+    def normalize_word(word):
+        return diacritics.sub("", word.strip()).translate(hamza)
+
+    def normalize_al(word):
+        return word[2:] if word.startswith("ال") else word
+
+    def words_are_same(word1, word2):
+        return normalize_al(word1.strip()).lower() == normalize_al(word2.strip()).lower()
+
+    def strip_label(choice):
+        if re.match(r'^[أ-د][\)\-]', choice):
+            return re.sub(r'^[أ-د][\)\-]\s*', '', choice)
+        return choice
+
+    def cold_without_word():
+        compare_key.cache_clear()
+        return without_word(words, "الكرم")
+
+    cases = [
+        ("normalize word", lambda: [normalize_word(w) for w in words], lambda: [normalize(w) for w in words]),
+        ("normalize sentence", lambda: " ".join(non_arabic.sub(" ", normalize_word(sentence)).split()),
+         lambda: letters_only(sentence)),
+        # The baseline compared without any normalization, so this one buys folding rather than speed
+        ("compare choices", lambda: [w for w in words if not words_are_same(w, "الكرم")], cold_without_word),
+        ("strip choice labels", lambda: [strip_label(c) for c in choices], lambda: choice_words(choices)),
+    ]
+    print(f"{'case':<22}{'before us':>10}{'table us':>10}{'speedup':>9}")
+    for name, old, new in cases:
+        old_time = min(timeit.repeat(old, number=number, repeat=3)) / number * 1e6
+        new_time = min(timeit.repeat(new, number=number, repeat=3)) / number * 1e6
+        print(f"{name:<22}{old_time:>10.2f}{new_time:>10.2f}{old_time / new_time:>8.1f}x")
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -0,0 +1,138 @@
+"""End-to-end throughput and latency benchmark against the local OpenAI stand-in.
+
+    python benchmark.py --runs 30 --time-scale 0.05 --rate-limit-rate 0.05 --malformed-rate 0.2
+
+Every generator runs --runs times against fake_openai.FakeOpenAI with the
+response cache cleared between runs, and the report lists p50/p95/p99 latency,
+LLM calls per accepted question and tokens per accepted question. Pass
+--corpus to use the reference files under ./data instead of the built-in lines.
+"""
+import argparse
+import json
+import sys
+import time
+import llm_client
+import metrics
+from model_router import tier_report
+from prompt_budget import token_report
+from fake_openai import FakeOpenAI, REFERENCE_QUESTIONS, add_profile_arguments, profile_from_args
+from question_generator import (
+    create_question,
+    generate_meaning_test,
+    generate_contextual_question,
+    generate_contextual_test
+)
+
+GRADE = "الصف السابع والثامن"
+WORDS = ["السخاء", "برع", "الشجاعة", "شاسع", "الوفاء"]
+
+SCENARIOS = {
+    "word_meaning": lambda refs, run, size: [create_question(WORDS[run % len(WORDS)], refs, GRADE)],
+    "meaning_test": lambda refs, run, size: generate_meaning_test(size, refs, GRADE),
+    "contextual": lambda refs, run, size: [generate_contextual_question(refs, GRADE)],
+    "contextual_test": lambda refs, run, size: generate_contextual_test(size, refs, GRADE),
+}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def run_scenario(name, client, reference_questions, runs, test_size, action_deadline):
+    scenario = SCENARIOS[name]
+    latencies = []
+    accepted = failed_runs = 0
+    client.model.reset_stats()
+    for run in range(runs):
+        llm_client.response_cache.clear()
+        started = time.perf_counter()
+        try:
+            with llm_client.deadline(action_deadline), metrics.span("action", scenario=name):
+                items = scenario(reference_questions, run, test_size)
+        except Exception:
+            items = []
+        latencies.append(time.perf_counter() - started)
+        good = sum(1 for item in items if item and item[0] and item[1])
+        accepted += good
+        if not good:
+            failed_runs += 1
+    stats = client.model.stats()
+    tokens = stats["prompt_tokens"] + stats["completion_tokens"]
+    per_question = max(accepted, 1)
+    return {
+        "scenario": name,
+        "runs": runs,
+        "accepted": accepted,
+        "failed_runs": failed_runs,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "calls": stats["calls"],
+        "calls_per_question": stats["calls"] / per_question,
+        "tokens_per_question": tokens / per_question,
+        "prompt_tokens": stats["prompt_tokens"],
+        "completion_tokens": stats["completion_tokens"],
+        "rate_limited": stats["rate_limited"],
+        "errors": stats["errors"],
+    }
+
+
+def print_report(results):
+    header = f"{'scenario':<16}{'runs':>6}{'ok':>6}{'p50 s':>9}{'p95 s':>9}{'p99 s':>9}{'calls/q':>9}{'tokens/q':>10}{'429':>6}{'5xx':>6}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r['scenario']:<16}{r['runs']:>6}{r['accepted']:>6}{r['p50']:>9.3f}{r['p95']:>9.3f}{r['p99']:>9.3f}"
+            f"{r['calls_per_question']:>9.2f}{r['tokens_per_question']:>10.0f}{r['rate_limited']:>6}{r['errors']:>6}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the question generators against a fake OpenAI endpoint.")
+    parser.add_argument("--runs", type=int, default=20, help="runs per scenario")
+    parser.add_argument("--test-size", type=int, default=5, help="questions per generated test")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="run only these scenarios")
+    parser.add_argument("--deadline", type=float, default=llm_client.ACTION_DEADLINE, help="seconds allowed per run")
+    parser.add_argument("--corpus", action="store_true", help="use the reference files under ./data")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--metrics-file", help="write the collected Prometheus metrics to this file")
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    reference_questions = REFERENCE_QUESTIONS
+    if args.corpus:
+        from reference_loader import load_reference_questions
+        reference_questions = load_reference_questions("الصف_السابع_والثامن", "الأسئلة_اللفظية")
+    client = llm_client.set_client(FakeOpenAI(profile_from_args(args)))
+
+    results = [
+        run_scenario(name, client, reference_questions, args.runs, args.test_size, args.deadline)
+        for name in (args.scenario or SCENARIOS)
+    ]
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_report(results)
+        tokens = token_report()
+        print(
+            f"\ninput tokens {tokens['input']}, sent as stable prefix {tokens['prefix']}, "
+            f"trimmed {tokens['trimmed']}, served from provider cache {tokens['provider_cached']}"
+        )
+        for tier, row in sorted(tier_report().items()):
+            print(
+                f"{tier:<10}{row['model']:<16}{row['calls']:>6} calls  {row['failure_rate']:>6.1%} failed  "
+                f"{row['mean_seconds']:>7.3f} s/call  ${row['cost_usd']:.4f}"
+            )
+    if args.metrics_file:
+        metrics.write_metrics_file(args.metrics_file)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
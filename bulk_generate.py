@@ -0,0 +1,224 @@
+"""Headless bulk exam generation.
+
+Run from the repository root (reference files are read from ./data):
+
+    python bulk_generate.py manifest.json --output exams.jsonl --concurrency 32 --processes 4
+
+The manifest lists jobs; each job expands into units (one question, or one
+test of test_size questions) that are generated concurrently and appended to
+the output JSONL as they complete. Units already present in the output are
+skipped, so an interrupted run resumes where it stopped.
+
+    {"jobs": [
+        {"question_type": "معنى الكلمة", "words": ["السخاء", "برع"], "count": 3},
+        {"question_type": "اختبار معاني الكلمات (تلقائي)", "count": 200, "test_size": 10},
+        {"question_type": "معنى الكلمة حسب السياق", "count": 100, "test_size": 5}
+    ]}
+
+grade, grade_folder and skill_folder default to the app's only grade and skill.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from llm_client import deadline, fresh_samples
+from metrics import span
+from reference_loader import load_reference_questions
+from question_generator import (
+    create_question,
+    generate_meaning_test,
+    generate_contextual_question,
+    generate_contextual_test
+)
+from question_pool import WORD_MEANING, MEANING_TEST, CONTEXTUAL
+
+DEFAULT_JOB = {
+    "grade": "الصف السابع والثامن",
+    "grade_folder": "الصف_السابع_والثامن",
+    "skill_folder": "الأسئلة_اللفظية",
+    "count": 1,
+    "test_size": 5,
+}
+UNIT_DEADLINE = 300.0
+PROGRESS_EVERY = 25
+# How often iter_records checks that its worker processes are still alive
+WORKER_POLL_INTERVAL = 5.0
+
+
+def expand_units(manifest):
+    """Turn manifest jobs into units with stable ids so reruns can skip finished work"""
+    units = []
+    for job_index, raw_job in enumerate(manifest.get("jobs", [])):
+        job = dict(DEFAULT_JOB, **raw_job)
+        question_type = job["question_type"]
+        if question_type not in (WORD_MEANING, MEANING_TEST, CONTEXTUAL):
+            raise ValueError(f"job {job_index}: unknown question_type {question_type!r}")
+        base = {
+            "grade": job["grade"],
+            "grade_folder": job["grade_folder"],
+            "skill_folder": job["skill_folder"],
+            "question_type": question_type,
+        }
+        if question_type == WORD_MEANING:
+            for word in job.get("words", []):
+                for i in range(job["count"]):
+                    units.append(dict(base, id=f"{job_index}:{word}:{i}", main_word=word, size=1))
+        else:
+            for i in range(job["count"]):
+                units.append(dict(base, id=f"{job_index}:{i}", size=job["test_size"]))
+    return units
+
+
+def generate_unit(unit, unit_deadline=UNIT_DEADLINE):
+    """Generate one unit and return its output record (questions may be empty on failure)"""
+    started = time.monotonic()
+    reference_questions = load_reference_questions(unit["grade_folder"], unit["skill_folder"])
+    grade = unit["grade"]
+    items = []
+    if reference_questions:
+        # Each unit is its own sample: a word repeated across units must not replay a cached answer
+        with deadline(unit_deadline), fresh_samples(), span("action", question_type=unit["question_type"], unit=unit["id"]):
+            if unit["question_type"] == WORD_MEANING:
+                items = [create_question(unit["main_word"], reference_questions, grade)]
+            elif unit["question_type"] == MEANING_TEST:
+                items = generate_meaning_test(unit["size"], reference_questions, grade)
+            elif unit["size"] == 1:
+                items = [generate_contextual_question(reference_questions, grade)]
+            else:
+                items = generate_contextual_test(unit["size"], reference_questions, grade)
+    questions = [
+        {"question": item[0], "answer": item[1], "message": item[2] if len(item) > 2 else None}
+        for item in items
+        if item[0] and item[1]
+    ]
+    return dict(unit, questions=questions, elapsed=round(time.monotonic() - started, 3))
+
+
+def iter_unit_records(units, concurrency, unit_deadline):
+    """Generate units on a thread pool, yielding each record as soon as it completes"""
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = {executor.submit(generate_unit, unit, unit_deadline): unit for unit in units}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                yield dict(futures[future], questions=[], error=repr(e))
+
+
+def _process_worker(units, concurrency, unit_deadline, results):
+    for record in iter_unit_records(units, concurrency, unit_deadline):
+        results.put(record)
+    results.put(None)
+
+
+def iter_records(units, concurrency, processes, unit_deadline):
+    """Yield unit records as they complete, sharding units across processes when processes > 1"""
+    if processes <= 1:
+        yield from iter_unit_records(units, concurrency, unit_deadline)
+        return
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    per_process = max(1, concurrency // processes)
+    workers = [
+        ctx.Process(target=_process_worker, args=(shard, per_process, unit_deadline, results), daemon=True)
+        for shard in (units[i::processes] for i in range(processes))
+        if shard
+    ]
+    for worker in workers:
+        worker.start()
+    remaining = len(workers)
+    crashed = set()
+    while remaining:
+        try:
+            record = results.get(timeout=WORKER_POLL_INTERVAL)
+        except queue.Empty:
+            # A worker that died never sends its end marker; stop waiting for it
+            for worker in workers:
+                if worker.exitcode not in (None, 0) and worker.pid not in crashed:
+                    crashed.add(worker.pid)
+                    remaining -= 1
+                    print(f"worker {worker.pid} exited with code {worker.exitcode}; "
+                          "its unfinished units are retried on the next run", file=sys.stderr)
+            if all(worker.exitcode is not None for worker in workers):
+                break
+            continue
+        if record is None:
+            remaining -= 1
+        else:
+            yield record
+    for worker in workers:
+        worker.join(WORKER_POLL_INTERVAL)
+
+
+def load_checkpoint(output_path):
+    """Ids of units already written to the output file"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)["id"])
+            except (ValueError, KeyError):
+                # A partial last line from an interrupted run; the unit is redone
+                continue
+    return done
+
+
+def _ensure_trailing_newline(output_path):
+    if os.path.exists(output_path) and os.path.getsize(output_path):
+        with open(output_path, "rb+") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate exam variants in bulk from a manifest.")
+    parser.add_argument("manifest", help="JSON manifest of jobs")
+    parser.add_argument("--output", default="bulk_output.jsonl", help="JSONL file results are appended to")
+    parser.add_argument("--concurrency", type=int, default=16, help="units in flight across all processes")
+    parser.add_argument("--processes", type=int, default=1, help="worker processes to shard units over")
+    parser.add_argument("--unit-deadline", type=float, default=UNIT_DEADLINE, help="seconds allowed per unit")
+    args = parser.parse_args(argv)
+
+    with open(args.manifest, encoding="utf-8") as f:
+        units = expand_units(json.load(f))
+    done = load_checkpoint(args.output)
+    pending = [unit for unit in units if unit["id"] not in done]
+    print(f"{len(units)} units, {len(units) - len(pending)} already done, {len(pending)} to generate", file=sys.stderr)
+    if not pending:
+        return 0
+
+    _ensure_trailing_newline(args.output)
+    started = time.monotonic()
+    written = failed = questions = 0
+    with open(args.output, "a", encoding="utf-8") as out:
+        for record in iter_records(pending, args.concurrency, args.processes, args.unit_deadline):
+            if len(record["questions"]) < record["size"]:
+                # Not checkpointed, so the next run retries it
+                failed += 1
+                continue
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            written += 1
+            questions += len(record["questions"])
+            if written % PROGRESS_EVERY == 0:
+                minutes = (time.monotonic() - started) / 60
+                print(f"{written}/{len(pending)} units, {questions / minutes:.1f} questions/min", file=sys.stderr)
+
+    minutes = max((time.monotonic() - started) / 60, 1e-9)
+    print(
+        f"done: {written} units, {questions} questions, {failed} failed, "
+        f"{questions / minutes:.1f} questions/min",
+        file=sys.stderr,
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
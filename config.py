@@ -1,9 +1,39 @@
-import streamlit as st
+import os
+import sys
+
+
+def _streamlit_secret(section, key):
+    # Secrets are only consulted inside a Streamlit app; headless callers never import Streamlit
+    if "streamlit" not in sys.modules:
+        return None
+    try:
+        return sys.modules["streamlit"].secrets[section][key]
+    except Exception:
+        return None
+
 
 def get_openai_api_key():
-    return st.secrets["openai"]["api_key"]
+    """API key from OPENAI_API_KEY, falling back to Streamlit secrets ([openai] api_key)"""
+    api_key = os.environ.get("OPENAI_API_KEY") or _streamlit_secret("openai", "api_key")
+    if not api_key:
+        raise RuntimeError("OpenAI API key not configured: set OPENAI_API_KEY or [openai] api_key in Streamlit secrets")
+    return api_key
+
+
+def get_openai_base_url():
+    """Optional endpoint override from OPENAI_BASE_URL or Streamlit secrets ([openai] base_url)"""
+    return os.environ.get("OPENAI_BASE_URL") or _streamlit_secret("openai", "base_url")
+
+
+def get_generation_service_url():
+    """Optional generation service URL from GENERATION_SERVICE_URL or Streamlit secrets ([service] url)"""
+    return os.environ.get("GENERATION_SERVICE_URL") or _streamlit_secret("service", "url")
+
+
+def get_model_setting(name):
+    """Model routing setting from the NAME environment variable or Streamlit secrets ([models] name)"""
+    return os.environ.get(name.upper()) or _streamlit_secret("models", name.lower())
 
 
 # Path to your reference data directory (as before)
-import os
 DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
@@ -0,0 +1,198 @@
+import contextlib
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+import numpy as np
+from arabic_text import compare_key, letters_only
+
+DEDUP_PATH = os.path.join(".cache", "dedup.sqlite3")
+
+# MinHash over character shingles; 16 bands of 4 rows find pairs above ~0.5 Jaccard,
+# which are then confirmed against SENTENCE_THRESHOLD
+SHINGLE_SIZE = 4
+NUM_PERM = 64
+BANDS = 16
+SENTENCE_THRESHOLD = 0.7
+# How many of the most recent words go into a prompt's exclusion list
+EXCLUDE_LIMIT = 40
+
+# Indexes kept in memory: least recently used beyond DEDUP_MAX_SCOPES, and any idle for DEDUP_IDLE_TTL, are dropped
+DEDUP_MAX_SCOPES = 1024
+DEDUP_IDLE_TTL = 6 * 60 * 60
+# Anonymous sessions are never seen again once they end, so their scopes are kept in memory only
+SESSION_SCOPE_PREFIX = "session-"
+
+_PRIME = (1 << 31) - 1
+_rng = np.random.RandomState(20240601)
+_PERM_A = _rng.randint(1, _PRIME, size=NUM_PERM).astype(np.uint64)
+_PERM_B = _rng.randint(0, _PRIME, size=NUM_PERM).astype(np.uint64)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS words (
+    scope TEXT NOT NULL,
+    word_key TEXT NOT NULL,
+    word TEXT NOT NULL,
+    added_at REAL NOT NULL,
+    PRIMARY KEY (scope, word_key)
+);
+CREATE TABLE IF NOT EXISTS sentences (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    scope TEXT NOT NULL,
+    sentence TEXT NOT NULL,
+    signature BLOB NOT NULL,
+    added_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sentences_scope ON sentences (scope);
+"""
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def word_key(word):
+    """Dedup key of a word: diacritics and tatweel removed, hamza forms folded, ال stripped"""
+    return compare_key(word)
+
+
+def sentence_shingles(sentence):
+    text = letters_only(sentence)
+    if len(text) <= SHINGLE_SIZE:
+        return {text} if text else set()
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def minhash(shingles):
+    """NUM_PERM-value MinHash signature of a shingle set"""
+    if not shingles:
+        return np.full(NUM_PERM, _PRIME, dtype=np.uint64)
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little") % _PRIME for s in shingles),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+    return ((_PERM_A[:, None] * hashes[None, :] + _PERM_B[:, None]) % _PRIME).min(axis=1)
+
+
+def _bands(signature):
+    rows = NUM_PERM // BANDS
+    return [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(BANDS)]
+
+
+class DedupIndex:
+    """Words and sentences already used in one scope (a teacher or session), persisted to SQLite
+
+    Words match on word_key; sentences match when their estimated Jaccard
+    similarity reaches SENTENCE_THRESHOLD. claim_* checks and records in one
+    step, so concurrent generators never both accept the same item.
+    """
+
+    def __init__(self, scope, path=DEDUP_PATH):
+        self.scope = scope
+        self.path = path
+        self._lock = threading.Lock()
+        self._words = {}
+        self._signatures = []
+        self._buckets = {}
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self._connect() as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(_SCHEMA)
+                for key, word in conn.execute(
+                    "SELECT word_key, word FROM words WHERE scope = ? ORDER BY added_at", (scope,)
+                ):
+                    self._words[key] = word
+                for (blob,) in conn.execute("SELECT signature FROM sentences WHERE scope = ? ORDER BY id", (scope,)):
+                    self._index_signature(np.frombuffer(blob, dtype=np.uint64))
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _index_signature(self, signature):
+        position = len(self._signatures)
+        self._signatures.append(signature)
+        for band in _bands(signature):
+            self._buckets.setdefault(band, []).append(position)
+
+    def _near_duplicate(self, signature):
+        candidates = {position for band in _bands(signature) for position in self._buckets.get(band, ())}
+        return any(np.mean(self._signatures[p] == signature) >= SENTENCE_THRESHOLD for p in candidates)
+
+    def seen_word(self, word):
+        with self._lock:
+            return word_key(word) in self._words
+
+    def seen_sentence(self, sentence):
+        signature = minhash(sentence_shingles(sentence))
+        with self._lock:
+            return self._near_duplicate(signature)
+
+    def claim_word(self, word):
+        """Record word and return True, or return False if it (or a normalized form of it) was used"""
+        key = word_key(word)
+        if not key:
+            return False
+        with self._lock:
+            if key in self._words:
+                return False
+            self._words[key] = word
+        if self.path:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR IGNORE INTO words (scope, word_key, word, added_at) VALUES (?, ?, ?, ?)",
+                    (self.scope, key, word, time.time()),
+                )
+        return True
+
+    def claim_sentence(self, sentence):
+        """Record sentence and return True, or return False if a near-duplicate was used"""
+        signature = minhash(sentence_shingles(sentence))
+        with self._lock:
+            if self._near_duplicate(signature):
+                return False
+            self._index_signature(signature)
+        if self.path:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT INTO sentences (scope, sentence, signature, added_at) VALUES (?, ?, ?, ?)",
+                    (self.scope, sentence, signature.tobytes(), time.time()),
+                )
+        return True
+
+    def excluded_words(self, limit=EXCLUDE_LIMIT):
+        """The most recently used words, for a prompt's exclusion list"""
+        with self._lock:
+            return list(self._words.values())[-limit:]
+
+
+def session_scope():
+    """A new scope for an anonymous session"""
+    return f"{SESSION_SCOPE_PREFIX}{uuid.uuid4().hex}"
+
+
+def get_dedup_index(scope, path=DEDUP_PATH):
+    """Shared index for a scope, loaded from disk on first use; session scopes are not persisted"""
+    if scope.startswith(SESSION_SCOPE_PREFIX):
+        path = None
+    now = time.monotonic()
+    with _indexes_lock:
+        entry = _indexes.pop((scope, path), None)
+        index = entry[0] if entry else DedupIndex(scope, path)
+        _indexes[(scope, path)] = (index, now)
+        while _indexes:
+            oldest, (_, used_at) = next(iter(_indexes.items()))
+            if len(_indexes) <= DEDUP_MAX_SCOPES and now - used_at <= DEDUP_IDLE_TTL:
+                break
+            del _indexes[oldest]
+        return index
@@ -0,0 +1,143 @@
+import random
+import re
+import threading
+from arabic_morphology import analyze, letter_count, share_root
+from arabic_text import arabic_tokens, compare_key, has_al, split_choice_label, strip_diacritics
+
+MIN_LETTERS = 3
+MAX_LETTERS = 8
+
+
+# Function words and question scaffolding that make poor distractors
+STOPWORDS = {
+    "الذي", "التي", "الذين", "اللذان", "هذا", "هذه", "ذلك", "تلك", "هؤلاء", "كان", "كانت",
+    "يكون", "ليس", "ليست", "على", "إلى", "الى", "عن", "مع", "بين", "عند", "حتى", "ثم",
+    "لكن", "إذا", "اذا", "إن", "أن", "كل", "بعض", "غير", "قد", "لقد", "لم", "لن",
+    "ماذا", "لماذا", "كيف", "متى", "أين", "هل", "كلمة", "معنى", "السؤال", "الإجابة",
+    "الصحيحة", "الجملة", "السياق", "أعلاه", "الخيارات", "اختر", "الكلمة", "المناسبة",
+    "أما", "التعليمات", "تعليمات", "البدائل", "اللفظية", "المستوى", "القدرات", "القدرة",
+    "استخدم", "ابدأ", "اختبار", "اختبارات", "مثال", "تدريبي", "رمز", "الأقرب", "الرئيسية",
+}
+
+# Choice labels inside a line of the corpus, e.g. "أ- مساكن   ب- مداخل   ج- مراجع   د- محاسن"
+_CHOICE_START = re.compile(r"(?:^|\s+)(?=[\u0623\u0628\u062C\u062F]\s*[\)\-])")
+# ال before أ/إ/آ/م/ج/ح/خ comes out of some PDFs as ا + letter + ل (األصيل, اجلحود, املعنى)
+_BROKEN_LIGATURE = re.compile(r"^\u0627[\u0622\u0623\u0625\u0645\u062C\u062D\u062E]\u0644")
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def _strip_clitics(word):
+    """Reduce وال/فال/بال/كال/لل forms to the bare definite word"""
+    for prefix in ("وال", "فال", "بال", "كال"):
+        if word.startswith(prefix) and len(word) > 5:
+            return "ال" + word[3:]
+    if word.startswith("لل") and len(word) > 4:
+        return "ال" + word[2:]
+    return word
+
+
+def _convert_al(word, want_al):
+    if want_al and not has_al(word):
+        return "ال" + word
+    if not want_al and has_al(word) and len(word) > 4:
+        return word[2:]
+    return word
+
+
+def _is_broken(word):
+    """PDF extraction damage: a split lam-alef style ligature, or ال left with a single letter"""
+    return bool(_BROKEN_LIGATURE.match(word)) or (has_al(word) and len(word) < 4)
+
+
+def choice_tokens(line):
+    """First word of every labelled choice on a corpus line; other lines yield nothing"""
+    for segment in _CHOICE_START.split(line.strip()):
+        label, text = split_choice_label(segment)
+        tokens = arabic_tokens(text) if label else []
+        if tokens:
+            yield tokens[0]
+
+
+class DistractorIndex:
+    """Answer choices of the reference corpus bucketed by ال form, letter count and pattern (وزن)"""
+
+    def __init__(self, lines):
+        self._buckets = {}
+        self.size = 0
+        seen = set()
+        for line in lines:
+            for token in choice_tokens(line):
+                word = _strip_clitics(strip_diacritics(token))
+                if word in seen or word in STOPWORDS or _is_broken(word):
+                    continue
+                seen.add(word)
+                count = letter_count(word)
+                if count < MIN_LETTERS or count > MAX_LETTERS:
+                    continue
+                self._add(word)
+
+    def _add(self, word):
+        al, count, pattern = has_al(word), letter_count(word), analyze(word)[1]
+        for key in ((al, count, pattern), (al, count, None)):
+            self._buckets.setdefault(key, []).append(word)
+        self.size += 1
+
+    def _candidate_buckets(self, correct):
+        al, count, pattern = has_al(correct), letter_count(correct), analyze(correct)[1]
+        # Same form and pattern first, then the other ال form, then the same letter count only
+        keys = []
+        if pattern is not None:
+            keys += [(al, count, pattern), (not al, count, pattern)]
+        keys += [(al, count, None), (not al, count, None)]
+        for key in keys:
+            bucket = self._buckets.get(key)
+            if bucket:
+                yield key[0] == al, bucket
+
+    def sample(self, correct, k=3, exclude=()):
+        """Draw k distractors shaped like correct, avoiding its root and any excluded word"""
+        avoid = [correct] + list(exclude)
+        avoid_keys = {compare_key(w) for w in avoid}
+        want_al = has_al(correct)
+        picked = []
+        for same_form, bucket in self._candidate_buckets(correct):
+            for word in random.sample(bucket, min(len(bucket), k * 4)):
+                word = word if same_form else _convert_al(word, want_al)
+                if word in picked or compare_key(word) in avoid_keys:
+                    continue
+                if any(share_root(word, other) for other in avoid):
+                    continue
+                picked.append(word)
+                if len(picked) == k:
+                    return picked
+        return picked
+
+
+def get_distractor_index(reference_questions):
+    """Index for a corpus, built once per corpus version"""
+    version = getattr(reference_questions, "version", None) or hash(tuple(reference_questions))
+    with _indexes_lock:
+        index = _indexes.get(version)
+        if index is None:
+            index = DistractorIndex(reference_questions)
+            _indexes[version] = index
+        return index
+
+
+def _check():
+    """Build the index from the bundled corpora and sample it; fails on scaffolding or PDF-mangled words"""
+    from reference_loader import load_reference_questions
+    lines = load_reference_questions("الصف_السابع_والثامن", "الأسئلة_اللفظية")
+    index = DistractorIndex(lines)
+    words = [word for bucket_key, bucket in index._buckets.items() if bucket_key[2] is None for word in bucket]
+    bad = [word for word in words if word in STOPWORDS or _is_broken(word)]
+    print(f"{index.size} words from {len(lines)} lines")
+    for correct in ("الكرم", "مفاخر", "فاق", "انتشر"):
+        print(correct, index.sample(correct))
+    assert index.size and not bad, bad
+
+
+if __name__ == "__main__":
+    _check()
@@ -0,0 +1,447 @@
+"""Local stand-in for the OpenAI chat completions API.
+
+FakeOpenAI mimics the parts of openai.OpenAI the generators use
+(chat.completions.create, streaming and with_options) and answers from a small
+corpus of realistic, malformed and intro-text-polluted Arabic responses, with
+configurable latency and error rates. Inject it with llm_client.set_client().
+
+The same model can be served over HTTP for clients that need a real endpoint:
+
+    python fake_openai.py --port 8089 --latency-median 0.4 --rate-limit-rate 0.05
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=fake python bulk_generate.py ...
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+WORDS = [
+    ("الخضوع", "الخشوع", ["الجحود", "القعود", "الركوع"]),
+    ("برع", "فاق", ["رام", "نام", "خاف"]),
+    ("مآثر", "مفاخر", ["مصاعب", "مخاطر", "منازل"]),
+    ("السخاء", "الكرم", ["البخل", "الحكمة", "السرعة"]),
+    ("الشجاعة", "الإقدام", ["الخوف", "الكسل", "الحزن"]),
+    ("سعى", "جد", ["نام", "قعد", "لهى"]),
+    ("الوفاء", "الإخلاص", ["الغدر", "الكذب", "الجفاء"]),
+    ("بهجة", "سرور", ["حزن", "غضب", "ملل"]),
+    ("الحلم", "الأناة", ["الغضب", "الطيش", "العجلة"]),
+    ("شاسع", "واسع", ["ضيق", "قريب", "صغير"]),
+]
+
+CONTEXTUAL = [
+    ("وَجَمَ الرجل بعد أن طُرد من عمله", "وَجَم", ["شرد", "تعب", "عبس", "سكت"], "ج"),
+    ("يحظى المواطن بالحرية في بلاده", "يحظى", ["يدعو", "يفرح", "يحيى", "ينال"], "د"),
+    ("بهرَ فلانٌ نظراءه", "بهر", ["سادَ", "قادَ", "فاقَ", "لامَ"], "ج"),
+    ("والليل إذا عسعس", "عسعس", ["طال", "أظلم", "قصر", "أمطر"], "ب"),
+    ("انبثق الماء غزيرا", "انبثق", ["انحصر", "انتشر", "انقطع", "اندفع"], "د"),
+    ("اشرأبت الزرافات بأعناقها", "اشرأبت", ["امتدّت", "اشتدّت", "قصرت", "ابتهجت"], "أ"),
+]
+
+# Long intros are stripped by clean_llm_response; short ones survive and break parsing
+LONG_INTRO = "بالطبع، إليك قائمة الخيارات المطلوبة مع مراعاة جميع التعليمات التي ذكرتها في طلبك:"
+SHORT_INTRO = "بالتأكيد!"
+
+# Lines a reference corpus typically contains, including PDF header noise
+REFERENCE_QUESTIONS = [
+    "اختبار القدرات اللفظية - المستوى الأول",
+    "الصفحة 1",
+    "اختر الكلمة الأقرب في المعنى إلى الكلمة التي تحتها خط:",
+] + [f"{main}: {synonym} - {' - '.join(distractors)}" for main, synonym, distractors in WORDS] + [
+    f"{sentence} ({target})" for sentence, target, _, _ in CONTEXTUAL
+]
+
+LETTERS = ["أ", "ب", "ج", "د"]
+
+# Like the real API: prefixes of at least 1024 tokens are cached in 128-token steps
+PREFIX_CACHE_MIN_TOKENS = 1024
+PREFIX_CACHE_STEP = 128
+MAIN_WORD = re.compile(r'(?:للكلمة(?: العربية)?|about) "([^"]+)"')
+
+
+@dataclass
+class FakeProfile:
+    """Latency and failure behaviour of the fake endpoint"""
+    latency_median: float = 0.8
+    latency_sigma: float = 0.5
+    time_scale: float = 1.0
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    retry_after: float = 1.0
+    malformed_rate: float = 0.1
+    intro_rate: float = 0.1
+    seed: int = None
+
+
+class FakeAPIError(Exception):
+    """Error shaped like openai.APIStatusError (status_code and response.headers)"""
+
+    def __init__(self, status_code, message, headers=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.response = SimpleNamespace(status_code=status_code, headers=headers or {})
+
+
+def estimate_tokens(text):
+    # Roughly three characters per token for Arabic with the GPT-4 tokenizers
+    return max(1, len(text) // 3)
+
+
+class FakeChatModel:
+    """Produces responses, latencies and failures for chat completion requests"""
+
+    def __init__(self, profile=None):
+        self.profile = profile or FakeProfile()
+        self.random = random.Random(self.profile.seed)
+        self.lock = threading.Lock()
+        self.seen_prefixes = set()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self.lock:
+            self.calls = 0
+            self.errors = 0
+            self.rate_limited = 0
+            self.prompt_tokens = 0
+            self.completion_tokens = 0
+            self.cached_tokens = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "calls": self.calls,
+                "errors": self.errors,
+                "rate_limited": self.rate_limited,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "cached_tokens": self.cached_tokens,
+            }
+
+    def _chance(self, rate):
+        with self.lock:
+            return self.random.random() < rate
+
+    def _choice(self, items):
+        with self.lock:
+            return self.random.choice(items)
+
+    def latency(self):
+        p = self.profile
+        with self.lock:
+            value = self.random.lognormvariate(0, p.latency_sigma) * p.latency_median
+        return value * p.time_scale
+
+    def check_failure(self):
+        """Raise the configured injected failures, counting the call either way"""
+        with self.lock:
+            self.calls += 1
+        if self._chance(self.profile.rate_limit_rate):
+            with self.lock:
+                self.rate_limited += 1
+            raise FakeAPIError(429, "Rate limit reached", {"retry-after": str(self.profile.retry_after * self.profile.time_scale)})
+        if self._chance(self.profile.error_rate):
+            with self.lock:
+                self.errors += 1
+            raise FakeAPIError(500, "Internal server error")
+
+    def record_usage(self, messages, content):
+        prompt_tokens = sum(estimate_tokens(m.get("content") or "") for m in messages)
+        completion_tokens = estimate_tokens(content)
+        cached_tokens = 0
+        prefix = messages[0].get("content") or "" if messages and messages[0].get("role") == "system" else ""
+        prefix_tokens = estimate_tokens(prefix) if prefix else 0
+        with self.lock:
+            if prefix_tokens >= PREFIX_CACHE_MIN_TOKENS:
+                if prefix in self.seen_prefixes:
+                    cached_tokens = prefix_tokens // PREFIX_CACHE_STEP * PREFIX_CACHE_STEP
+                self.seen_prefixes.add(prefix)
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cached_tokens += cached_tokens
+        return SimpleNamespace(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+            prompt_tokens_details=SimpleNamespace(cached_tokens=cached_tokens),
+        )
+
+    def respond(self, messages, response_format=None, **kwargs):
+        """Text the fake model answers with for a request"""
+        prompt = "\n".join(m.get("content") or "" for m in messages)
+        schema = ((response_format or {}).get("json_schema") or {}).get("name")
+        malformed = self._chance(self.profile.malformed_rate)
+        if schema == "contextual_questions":
+            match = re.search(r"أنشئ (\d+) أسئلة", prompt)
+            return self._contextual_batch(int(match.group(1)) if match else 1, malformed)
+        if schema == "synonym_verdicts":
+            return self._verdicts(prompt)
+        if schema == "word_meaning_choices":
+            return self._word_json(prompt, malformed)
+        if schema == "contextual_question":
+            return json.dumps(self._contextual_item(malformed), ensure_ascii=False)
+        if "كلمة عربية مناسبة لاختبار معاني الكلمات" in prompt:
+            text = "\n".join(self._shuffled([main for main, _, _ in WORDS]))
+        elif "مرادفًا واحدًا" in prompt:
+            text = self._word_entry(prompt)[1]
+        elif "Answer only with نعم" in prompt:
+            return self._choice(["نعم", "لا", "نعم، قريب في المعنى"])
+        elif "Generate 4 Arabic words" in prompt or "اكتب 3 كلمات مختلفة المعنى" in prompt:
+            main, synonym, distractors = self._word_entry(prompt)
+            words = [synonym] + distractors
+            text = "\n".join(words[:2] if malformed else words)
+        elif "يرجى توليد سؤال واحد" in prompt:
+            text = self._contextual_text(malformed)
+        else:
+            text = self._word_mcq(prompt, malformed)
+        if self._chance(self.profile.intro_rate):
+            text = self._choice([LONG_INTRO, SHORT_INTRO]) + "\n" + text
+        return text
+
+    def _shuffled(self, items):
+        items = list(items)
+        with self.lock:
+            self.random.shuffle(items)
+        return items
+
+    def _word_entry(self, prompt):
+        # The word being asked about, not the ones quoted in the prompt's examples
+        asked = MAIN_WORD.findall(prompt)
+        for entry in WORDS:
+            if asked and entry[0] == asked[-1]:
+                return entry
+        main, synonym, distractors = self._choice(WORDS)
+        return (asked[-1] if asked else main), synonym, distractors
+
+    def _word_mcq(self, prompt, malformed):
+        main, synonym, distractors = self._word_entry(prompt)
+        lines = [f"{synonym} (صحيح)"] + distractors
+        if malformed:
+            # Typical drift: the correct-answer marker or a choice goes missing
+            lines = self._choice([[synonym] + distractors, lines[:3], [main] + lines[1:]])
+        return "الكلمة الرئيسية: \"{}\"\nوزن الخيارات: متنوع\nالخيارات:\n{}".format(main, "\n".join(lines))
+
+    def _word_json(self, prompt, malformed):
+        # Strict schemas fix the shape but not the semantics, so drift shows up as wrong counts or indexes
+        main, synonym, distractors = self._word_entry(prompt)
+        choices = self._shuffled([synonym] + distractors)
+        correct = choices.index(synonym)
+        if malformed:
+            choices, correct = self._choice([(choices[:3], correct), (choices, 4)])
+        return json.dumps({"choices": choices, "correct": correct}, ensure_ascii=False)
+
+    def _contextual_item(self, malformed):
+        sentence, target, choices, correct = self._choice(CONTEXTUAL)
+        item = {"sentence": sentence, "target_word": target, "choices": list(choices), "correct": correct}
+        if malformed:
+            item["choices"] = item["choices"][:3]
+        return item
+
+    def _contextual_text(self, malformed):
+        sentence, target, choices, correct = self._choice(CONTEXTUAL)
+        lines = [f"السؤال: {sentence}", f"ما معنى كلمة \"{target}\" في السياق أعلاه؟", ""]
+        lines += [f"{LETTERS[i]}) {c}" for i, c in enumerate(choices)]
+        lines += ["", f"الإجابة الصحيحة: ({correct})"]
+        if malformed:
+            lines = self._choice([lines[:-1], lines[:4] + lines[-2:], [l.replace("السؤال:", "") for l in lines]])
+        return "\n".join(lines)
+
+    def _contextual_batch(self, count, malformed):
+        items = []
+        for i in range(count):
+            sentence, target, choices, correct = self._choice(CONTEXTUAL)
+            item = {"sentence": sentence, "target_word": f"{target}" if i < len(CONTEXTUAL) else f"{target}{i}",
+                    "choices": list(choices), "correct": correct}
+            if malformed and i == 0:
+                item["choices"] = item["choices"][:3]
+            items.append(item)
+        return json.dumps({"questions": items}, ensure_ascii=False)
+
+    def _verdicts(self, prompt):
+        ids = [int(n) for n in re.findall(r"^(\d+)\.", prompt, re.MULTILINE)]
+        return json.dumps({"verdicts": [{"id": i, "synonym": i % 4 == 1} for i in ids]})
+
+
+class _Completions:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def create(self, model=None, messages=(), stream=False, **kwargs):
+        model_state = self.owner.model
+        model_state.check_failure()
+        latency = model_state.latency()
+        timeout = self.owner.timeout
+        if timeout is not None and latency > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"fake request timed out after {timeout:.2f}s")
+        content = model_state.respond(messages, **kwargs)
+        usage = model_state.record_usage(messages, content)
+        if stream:
+            include_usage = (kwargs.get("stream_options") or {}).get("include_usage")
+            return self._stream(content, latency, usage if include_usage else None)
+        time.sleep(latency)
+        message = SimpleNamespace(content=content, role="assistant")
+        return SimpleNamespace(
+            model=model,
+            choices=[SimpleNamespace(index=0, message=message, finish_reason="stop")],
+            usage=usage,
+        )
+
+    def _stream(self, content, latency, usage=None):
+        # Half the latency before the first token, the rest spread over the chunks
+        time.sleep(latency / 2)
+        pieces = [content[i:i + 12] for i in range(0, len(content), 12)] or [""]
+        delay = latency / 2 / len(pieces)
+        for piece in pieces:
+            time.sleep(delay)
+            yield SimpleNamespace(choices=[SimpleNamespace(index=0, delta=SimpleNamespace(content=piece))], usage=None)
+        if usage is not None:
+            yield SimpleNamespace(choices=[], usage=usage)
+
+
+class FakeOpenAI:
+    """Drop-in replacement for the openai.OpenAI client backed by a FakeChatModel"""
+
+    def __init__(self, profile=None, model=None, timeout=None):
+        self.model = model or FakeChatModel(profile)
+        self.timeout = timeout
+        self.chat = SimpleNamespace(completions=_Completions(self))
+
+    def with_options(self, timeout=None, **kwargs):
+        return FakeOpenAI(model=self.model, timeout=timeout if timeout is not None else self.timeout)
+
+
+def _usage_json(usage):
+    return dict(vars(usage), prompt_tokens_details=vars(usage.prompt_tokens_details))
+
+
+def make_handler(model):
+    class FakeCompletionsHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status, payload, headers=None):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+            length = int(self.headers.get("Content-Length") or 0)
+            request = json.loads(self.rfile.read(length) or b"{}")
+            try:
+                model.check_failure()
+            except FakeAPIError as e:
+                self._send_json(e.status_code, {"error": {"message": str(e)}}, e.response.headers)
+                return
+            messages = request.get("messages", [])
+            content = model.respond(messages, response_format=request.get("response_format"))
+            usage = model.record_usage(messages, content)
+            latency = model.latency()
+            if request.get("stream"):
+                include_usage = (request.get("stream_options") or {}).get("include_usage")
+                self._stream(request, content, latency, usage if include_usage else None)
+                return
+            time.sleep(latency)
+            self._send_json(200, {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "fake"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": _usage_json(usage),
+            })
+
+        def _stream(self, request, content, latency, usage=None):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            time.sleep(latency / 2)
+            pieces = [content[i:i + 12] for i in range(0, len(content), 12)] or [""]
+            chunks = [{"index": 0, "delta": {"content": piece}, "finish_reason": None} for piece in pieces]
+            for choice in chunks + ([None] if usage is not None else []):
+                if choice is not None:
+                    time.sleep(latency / 2 / len(pieces))
+                chunk = {
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": request.get("model", "fake"),
+                    "choices": [choice] if choice is not None else [],
+                }
+                if choice is None:
+                    chunk["usage"] = _usage_json(usage)
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+
+    return FakeCompletionsHandler
+
+
+def serve(host="127.0.0.1", port=8089, profile=None):
+    """Start the fake endpoint in a background thread and return the server"""
+    server = ThreadingHTTPServer((host, port), make_handler(FakeChatModel(profile)))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-openai", daemon=True).start()
+    return server
+
+
+def add_profile_arguments(parser):
+    defaults = FakeProfile()
+    parser.add_argument("--latency-median", type=float, default=defaults.latency_median)
+    parser.add_argument("--latency-sigma", type=float, default=defaults.latency_sigma)
+    parser.add_argument("--time-scale", type=float, default=defaults.time_scale,
+                        help="multiply every simulated delay (e.g. 0.01 for quick runs)")
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--rate-limit-rate", type=float, default=defaults.rate_limit_rate)
+    parser.add_argument("--retry-after", type=float, default=defaults.retry_after)
+    parser.add_argument("--malformed-rate", type=float, default=defaults.malformed_rate)
+    parser.add_argument("--intro-rate", type=float, default=defaults.intro_rate)
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def profile_from_args(args):
+    return FakeProfile(
+        latency_median=args.latency_median,
+        latency_sigma=args.latency_sigma,
+        time_scale=args.time_scale,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        malformed_rate=args.malformed_rate,
+        intro_rate=args.intro_rate,
+        seed=args.seed,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a fake OpenAI chat completions endpoint.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+    server = serve(args.host, args.port, profile_from_args(args))
+    print(f"fake OpenAI endpoint on http://{args.host}:{args.port}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
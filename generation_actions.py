@@ -0,0 +1,93 @@
+"""The three user actions, shared by the Streamlit app and the generation service.
+
+Each action serves what it can from the question pool first, then generates
+the rest; pool and refiller may be None to always generate.
+"""
+import itertools
+from question_generator import (
+    create_question,
+    iter_meaning_test,
+    generate_contextual_question,
+    iter_contextual_test,
+    claim_meaning_question,
+    claim_contextual_question,
+    reshuffle_choices
+)
+from arabic_text import letters_only
+from question_pool import WORD_MEANING, MEANING_TEST, CONTEXTUAL
+from single_flight import SingleFlight
+
+# Generations tried for one contextual question whose word or sentence was already used
+SINGLE_CONTEXTUAL_ATTEMPTS = 3
+
+# Identical word requests in flight at the same time (a class asking for the same word) share one generation
+_word_meaning_flight = SingleFlight("word_meaning")
+
+
+def word_meaning(main_word, reference_questions, grade, grade_folder, skill_folder, pool=None, refiller=None):
+    """(question, answer, msg) for one word"""
+    pooled = pool.take(grade_folder, skill_folder, WORD_MEANING, 1, main_word) if pool else []
+    if pooled:
+        question, answer, msg = pooled[0]
+    else:
+        (question, answer, msg), shared = _word_meaning_flight.do(
+            (letters_only(main_word), grade, WORD_MEANING),
+            lambda: create_question(main_word, reference_questions, grade),
+        )
+        if shared:
+            # Each caller still gets its own layout of the shared choices
+            question, answer = reshuffle_choices(question, answer)
+    if refiller:
+        # Words requested more than once get a few variants kept ready for the next request
+        refiller.watch(grade_folder, skill_folder, WORD_MEANING, grade, main_word)
+    return question, answer, msg
+
+
+def iter_meaning_test_items(num_questions, reference_questions, grade, grade_folder, skill_folder,
+                            dedup=None, pool=None, refiller=None):
+    """Yield (question, answer, msg) tuples: pooled questions at once, generated ones as each is ready"""
+    test = pool.take(grade_folder, skill_folder, MEANING_TEST, num_questions) if pool else []
+    if dedup is not None:
+        test = [item for item in test if claim_meaning_question(dedup, item[0])]
+    stream = []
+    if len(test) < num_questions:
+        stream = iter_meaning_test(num_questions - len(test), reference_questions, grade, dedup)
+    yield from itertools.chain(test, stream)
+    if refiller:
+        refiller.wake()
+
+
+def iter_contextual_items(num_questions, reference_questions, grade, grade_folder, skill_folder,
+                          dedup=None, pool=None, refiller=None, on_token=None):
+    """Yield (question, answer_line) tuples; a single question streams its text to on_token"""
+    if num_questions == 1:
+        pooled = pool.take(grade_folder, skill_folder, CONTEXTUAL, 1) if pool else []
+        question = answer_line = None
+        if pooled and (dedup is None or claim_contextual_question(dedup, pooled[0][0])):
+            question, answer_line, _ = pooled[0]
+        for _ in range(SINGLE_CONTEXTUAL_ATTEMPTS):
+            if question:
+                break
+            excluded = dedup.excluded_words() if dedup is not None else ()
+            question, answer_line = generate_contextual_question(
+                reference_questions, grade, on_token=on_token, exclude_words=excluded
+            )
+            if not (question and answer_line):
+                break
+            if dedup is not None and not claim_contextual_question(dedup, question):
+                # A word or sentence this teacher/session already had; ask again
+                question = answer_line = None
+        if refiller:
+            refiller.wake()
+        if question and answer_line:
+            yield question, answer_line
+        return
+    test = [(q, a) for q, a, _ in pool.take(grade_folder, skill_folder, CONTEXTUAL, num_questions)] if pool else []
+    if dedup is not None:
+        test = [(q, a) for q, a in test if claim_contextual_question(dedup, q)]
+    stream = []
+    if len(test) < num_questions:
+        stream = iter_contextual_test(num_questions - len(test), reference_questions, grade, dedup)
+    yield from itertools.chain(test, stream)
+    if refiller:
+        refiller.wake()
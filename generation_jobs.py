@@ -0,0 +1,111 @@
+import threading
+import time
+import uuid
+from metrics import record_error
+
+# Finished jobs are kept this long for sessions that come back to them
+JOB_TTL = 30 * 60
+# How often a page showing a running job refreshes
+JOB_POLL_INTERVAL = 0.5
+
+
+class GenerationJob:
+    """One user action (a question or a test) running in a background thread
+
+    The target receives the job and reports through it: add() for each
+    finished item, notify() for warnings and errors, set_preview() for
+    streamed text and report() for reference extraction progress. Reruns
+    render snapshot() instead of holding any generation state themselves.
+    """
+
+    def __init__(self, kind, params, target):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = dict(params)
+        self.status = "running"
+        self.started_at = time.time()
+        self.finished_at = None
+        self._target = target
+        self._lock = threading.Lock()
+        self._items = []
+        self._notices = []
+        self._preview = ""
+        self._progress = None
+        self._thread = threading.Thread(target=self._run, name=f"generation-{self.id[:8]}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        status = "done"
+        try:
+            self._target(self)
+        except Exception as exc:
+            record_error("generation_job", exc)
+            self.notify("error", "حدث خطأ أثناء التوليد. حاول مجددًا.")
+            status = "failed"
+        with self._lock:
+            self.status = status
+            self.finished_at = time.time()
+            self._preview = ""
+            self._progress = None
+
+    @property
+    def running(self):
+        return self.status == "running"
+
+    def add(self, item):
+        with self._lock:
+            self._items.append(item)
+            self._preview = ""
+
+    def notify(self, level, text):
+        with self._lock:
+            self._notices.append((level, text))
+
+    def set_preview(self, text):
+        with self._lock:
+            self._preview = text
+
+    def report(self, done, total):
+        with self._lock:
+            self._progress = (done, total) if done < total else None
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "id": self.id,
+                "kind": self.kind,
+                "params": dict(self.params),
+                "status": self.status,
+                "items": list(self._items),
+                "notices": list(self._notices),
+                "preview": self._preview,
+                "progress": self._progress,
+            }
+
+
+class JobRegistry:
+    """Process-wide jobs by id, so a rerun (or a reconnecting session) can reattach to them"""
+
+    def __init__(self, ttl=JOB_TTL):
+        self.ttl = ttl
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def start(self, kind, params, target):
+        job = GenerationJob(kind, params, target)
+        with self._lock:
+            self._expire()
+            self._jobs[job.id] = job
+        return job.start()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished_at and job.finished_at < cutoff]:
+            del self._jobs[job_id]
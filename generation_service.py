@@ -0,0 +1,253 @@
+"""Asyncio JSON API over the question generators.
+
+    python generation_service.py --port 8700
+    python generation_service.py --fake --time-scale 0.05      # against fake_openai, no API key needed
+
+Endpoints (POST bodies and responses are JSON):
+
+    POST /v1/word-meaning       {"word", "scope"?}              -> {"question", "answer", "message"}
+    POST /v1/meaning-test       {"num_questions", "scope"?}     -> {"questions": [{"question", "answer", "message"}]}
+    POST /v1/contextual-test    {"num_questions", "scope"?}     -> {"questions": [{"question", "answer"}]}
+    GET  /healthz, GET /metrics
+
+Connections are handled on one event loop with HTTP/1.1 keep-alive, so
+hundreds of idle or waiting clients cost no threads. The generators
+themselves are blocking; they run on a worker pool of SERVICE_MAX_CONCURRENCY
+threads, and requests beyond that wait up to SERVICE_QUEUE_TIMEOUT seconds for
+a slot before a 503. The LLM calls those generations make, including test
+fan-out and hedges, are bounded separately by llm_client.LLM_MAX_CONCURRENCY,
+which matches its connection pool.
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+import generation_actions
+from dedup_index import get_dedup_index
+from llm_client import deadline, ACTION_DEADLINE, LLM_MAX_CONCURRENCY, create_client, set_client
+from metrics import count, observe, record_error, render_prometheus, span
+from question_pool import QuestionPool, PoolRefiller, MEANING_TEST, CONTEXTUAL
+from reference_loader import load_reference_questions
+
+SERVICE_HOST = os.environ.get("SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.environ.get("SERVICE_PORT", "8700"))
+# Generations running at once; they spend part of their time outside LLM calls, so twice the LLM slots keeps those busy
+SERVICE_MAX_CONCURRENCY = int(os.environ.get("SERVICE_MAX_CONCURRENCY", str(2 * LLM_MAX_CONCURRENCY)))
+SERVICE_QUEUE_TIMEOUT = float(os.environ.get("SERVICE_QUEUE_TIMEOUT", "30"))
+KEEPALIVE_TIMEOUT = 75.0
+MAX_BODY_BYTES = 64 * 1024
+MAX_TEST_QUESTIONS = 10
+
+GRADE = "الصف السابع والثامن"
+GRADE_FOLDER = "الصف_السابع_والثامن"
+SKILL_FOLDER = "الأسئلة_اللفظية"
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _num_questions(body):
+    value = body.get("num_questions", 3)
+    if not isinstance(value, int) or isinstance(value, bool) or not 1 <= value <= MAX_TEST_QUESTIONS:
+        raise RequestError(400, f"num_questions must be an integer from 1 to {MAX_TEST_QUESTIONS}")
+    return value
+
+
+def _dedup(body):
+    scope = body.get("scope")
+    return get_dedup_index(str(scope)) if scope else None
+
+
+class GenerationService:
+    def __init__(self, max_concurrency=SERVICE_MAX_CONCURRENCY, queue_timeout=SERVICE_QUEUE_TIMEOUT, pool=None, refiller=None):
+        self.queue_timeout = queue_timeout
+        self.pool = pool
+        self.refiller = refiller
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="generation")
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._routes = {
+            ("POST", "/v1/word-meaning"): self.word_meaning,
+            ("POST", "/v1/meaning-test"): self.meaning_test,
+            ("POST", "/v1/contextual-test"): self.contextual_test,
+            ("GET", "/healthz"): self.healthz,
+        }
+
+    async def _run(self, endpoint, fn, *args):
+        """Run a blocking generation on the worker pool once a slot is free"""
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            count("service_rejected_total", endpoint=endpoint, reason="busy")
+            raise RequestError(503, "all generation slots are busy")
+        try:
+            ctx = contextvars.copy_context()
+            return await asyncio.get_running_loop().run_in_executor(self._executor, ctx.run, fn, *args)
+        finally:
+            self._slots.release()
+
+    def _references(self):
+        reference_questions = load_reference_questions(GRADE_FOLDER, SKILL_FOLDER)
+        if not reference_questions:
+            raise RequestError(500, "no reference questions for this grade/skill")
+        return reference_questions
+
+    def _word_meaning(self, word):
+        with deadline(ACTION_DEADLINE), span("action", question_type="word_meaning", via="service"):
+            question, answer, msg = generation_actions.word_meaning(
+                word, self._references(), GRADE, GRADE_FOLDER, SKILL_FOLDER, self.pool, self.refiller
+            )
+        return {"question": question, "answer": answer, "message": msg}
+
+    def _meaning_test(self, num_questions, dedup):
+        with deadline(ACTION_DEADLINE), span("action", question_type="meaning_test", via="service"):
+            items = list(generation_actions.iter_meaning_test_items(
+                num_questions, self._references(), GRADE, GRADE_FOLDER, SKILL_FOLDER, dedup, self.pool, self.refiller
+            ))
+        return {"questions": [{"question": q, "answer": a, "message": msg} for q, a, msg in items]}
+
+    def _contextual_test(self, num_questions, dedup):
+        with deadline(ACTION_DEADLINE), span("action", question_type="contextual_test", via="service"):
+            items = list(generation_actions.iter_contextual_items(
+                num_questions, self._references(), GRADE, GRADE_FOLDER, SKILL_FOLDER, dedup, self.pool, self.refiller
+            ))
+        return {"questions": [{"question": q, "answer": a} for q, a in items]}
+
+    async def word_meaning(self, body):
+        word = str(body.get("word") or "").strip()
+        if not word:
+            raise RequestError(400, "word is required")
+        return await self._run("word_meaning", self._word_meaning, word)
+
+    async def meaning_test(self, body):
+        return await self._run("meaning_test", self._meaning_test, _num_questions(body), _dedup(body))
+
+    async def contextual_test(self, body):
+        return await self._run("contextual_test", self._contextual_test, _num_questions(body), _dedup(body))
+
+    async def healthz(self, body):
+        return {"status": "ok"}
+
+    async def dispatch(self, method, path, body):
+        """(status, payload) for one request; payload is a dict, or a str for text responses"""
+        if method == "GET" and path == "/metrics":
+            return 200, render_prometheus()
+        handler = self._routes.get((method, path))
+        if handler is None:
+            return 404, {"error": "not found"}
+        try:
+            data = json.loads(body or b"{}")
+            if not isinstance(data, dict):
+                raise ValueError
+        except ValueError:
+            return 400, {"error": "body must be a JSON object"}
+        try:
+            return 200, await handler(data)
+        except RequestError as exc:
+            return exc.status, {"error": str(exc)}
+        except Exception as exc:
+            record_error("service", exc)
+            return 500, {"error": "generation failed"}
+
+    async def handle_connection(self, reader, writer):
+        """Serve HTTP/1.1 requests on one connection until the client closes it or it idles out"""
+        try:
+            while True:
+                request_line = await asyncio.wait_for(reader.readline(), KEEPALIVE_TIMEOUT)
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length") or 0)
+                if length > MAX_BODY_BYTES:
+                    await self._respond(writer, 413, {"error": "body too large"}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                path = target.split("?", 1)[0]
+                loop = asyncio.get_running_loop()
+                started = loop.time()
+                status, payload = await self.dispatch(method, path, body)
+                count("service_requests_total", path=path, status=status)
+                observe("service_request_seconds", loop.time() - started, path=path)
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, payload, keep_alive):
+        if isinstance(payload, str):
+            body, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4"
+        else:
+            body, content_type = json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json; charset=utf-8"
+        head = [
+            f"HTTP/1.1 {status} {HTTPStatus(status).phrase}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {len(body)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        if status == 503:
+            head.append("Retry-After: 1")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    async def serve(self, host=SERVICE_HOST, port=SERVICE_PORT, ready=None):
+        server = await asyncio.start_server(self.handle_connection, host, port, backlog=1024)
+        if ready is not None:
+            ready(server)
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve question generation over HTTP.")
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--max-concurrency", type=int, default=SERVICE_MAX_CONCURRENCY)
+    parser.add_argument("--no-pool", action="store_true", help="always generate instead of serving from the question pool")
+    parser.add_argument("--fake", action="store_true", help="answer LLM calls with the in-process fake_openai model")
+    parser.add_argument("--openai-base-url", help="send LLM calls to this endpoint, e.g. python fake_openai.py (OPENAI_API_KEY may be any value)")
+    from fake_openai import FakeOpenAI, add_profile_arguments, profile_from_args
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if args.fake:
+        set_client(FakeOpenAI(profile_from_args(args)))
+    else:
+        set_client(create_client(base_url=args.openai_base_url))
+    pool = refiller = None
+    if not args.no_pool:
+        pool = QuestionPool()
+        refiller = PoolRefiller(pool)
+        refiller.watch(GRADE_FOLDER, SKILL_FOLDER, MEANING_TEST, GRADE)
+        refiller.watch(GRADE_FOLDER, SKILL_FOLDER, CONTEXTUAL, GRADE)
+        refiller.start()
+
+    async def run():
+        service = GenerationService(args.max_concurrency, pool=pool, refiller=refiller)
+        await service.serve(args.host, args.port, ready=lambda server: print(f"serving on http://{args.host}:{args.port}", flush=True))
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
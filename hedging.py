@@ -0,0 +1,182 @@
+"""Hedged requests for single-question generation.
+
+With HEDGE_REQUESTS=1 a question attempt that has not produced a valid
+result after the HEDGE_QUANTILE latency of recent attempts gets a parallel
+copy (up to HEDGE_MAX_EXTRA of them, HEDGE_DELAY_MIN apart at least). The
+first valid result wins and the rest are cancelled: streamed attempts stop
+reading at once, plain requests finish and are discarded.
+
+The primary attempt runs in the calling thread, so hedging never limits how
+many attempts run at once; only the copies share a HEDGE_MAX_WORKERS pool.
+
+Extra requests are capped by a process-wide budget: at most HEDGE_SPEND_CAP
+hedges per primary attempt on average, plus a small burst allowance.
+"""
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from metrics import count, observe, record_error
+
+HEDGE_REQUESTS = os.environ.get("HEDGE_REQUESTS") == "1"
+HEDGE_QUANTILE = float(os.environ.get("HEDGE_QUANTILE", "0.9"))
+HEDGE_MAX_EXTRA = int(os.environ.get("HEDGE_MAX_EXTRA", "1"))
+HEDGE_SPEND_CAP = float(os.environ.get("HEDGE_SPEND_CAP", "0.1"))
+HEDGE_BURST = 3
+
+# Until enough attempts have been timed, hedge after HEDGE_DELAY_DEFAULT seconds
+HEDGE_DELAY_DEFAULT = 6.0
+HEDGE_DELAY_MIN = 0.25
+HEDGE_MIN_SAMPLES = 20
+HEDGE_WINDOW = 200
+HEDGE_MAX_WORKERS = 16
+
+_executor = ThreadPoolExecutor(max_workers=HEDGE_MAX_WORKERS, thread_name_prefix="hedge")
+
+
+class Cancelled(Exception):
+    """Raised inside an attempt that lost the race, to stop it early"""
+
+
+class LatencyTracker:
+    """Recent attempt latencies per stage, for the hedging delay"""
+
+    def __init__(self, window=HEDGE_WINDOW):
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._window = window
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self._samples.setdefault(stage, deque(maxlen=self._window)).append(seconds)
+
+    def delay(self, stage, quantile=HEDGE_QUANTILE):
+        with self._lock:
+            samples = sorted(self._samples.get(stage, ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DELAY_DEFAULT
+        return max(HEDGE_DELAY_MIN, samples[min(len(samples) - 1, int(quantile * len(samples)))])
+
+
+class SpendBudget:
+    """Allows a hedge while hedges stay under cap * primaries + burst"""
+
+    def __init__(self, cap=HEDGE_SPEND_CAP, burst=HEDGE_BURST):
+        self._lock = threading.Lock()
+        self.cap = cap
+        self.burst = burst
+        self.primaries = 0
+        self.hedges = 0
+
+    def add_primary(self):
+        with self._lock:
+            self.primaries += 1
+
+    def try_spend(self):
+        with self._lock:
+            if self.hedges + 1 > self.cap * self.primaries + self.burst:
+                return False
+            self.hedges += 1
+            return True
+
+
+latency = LatencyTracker()
+budget = SpendBudget()
+
+
+class _Race:
+    def __init__(self, stage, attempt, on_token):
+        self.stage = stage
+        self.attempt = attempt
+        self.on_token = on_token
+        self.context = contextvars.copy_context()
+        self.cancelled = threading.Event()
+        self.lock = threading.Lock()
+        self.finished = threading.Condition(self.lock)
+        self.winner = None
+        self.winner_kind = None
+        self.primary_error = None
+        self.running = 0
+        self.extra = 0
+        self.timer = None
+
+    def _relay(self, text):
+        if not self.cancelled.is_set():
+            self.on_token(text)
+
+    def _run(self, kind):
+        # Only the primary streams, and it runs in the caller's thread
+        on_token = self._relay if kind == "primary" and self.on_token else None
+        started = time.perf_counter()
+        result = None
+        try:
+            result = self.attempt(self.cancelled, on_token)
+            latency.add(self.stage, time.perf_counter() - started)
+        except Cancelled:
+            pass
+        except Exception as exc:
+            if kind == "primary":
+                self.primary_error = exc
+            else:
+                record_error(f"{self.stage}_hedge", exc)
+        with self.lock:
+            self.running -= 1
+            if result is not None and self.winner is None:
+                self.winner, self.winner_kind = result, kind
+                self.cancelled.set()
+            self.finished.notify_all()
+
+    def _schedule(self):
+        if self.extra < HEDGE_MAX_EXTRA:
+            self.timer = threading.Timer(latency.delay(self.stage), self._hedge)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _hedge(self):
+        with self.lock:
+            if self.winner is not None or not self.running or self.cancelled.is_set():
+                return
+            if not budget.try_spend():
+                count("hedge_skipped_total", stage=self.stage, reason="budget")
+                return
+            self.extra += 1
+            self.running += 1
+            count("hedge_requests_total", stage=self.stage)
+            _executor.submit(self.context.copy().run, self._run, "hedge")
+            self._schedule()
+
+    def run(self):
+        started = time.perf_counter()
+        budget.add_primary()
+        with self.lock:
+            self.running += 1
+            self._schedule()
+        self._run("primary")
+        with self.lock:
+            # A failed primary still waits for the copies already sent
+            self.finished.wait_for(lambda: self.winner is not None or not self.running)
+            self.cancelled.set()
+            if self.timer:
+                self.timer.cancel()
+        observe("hedged_attempt_seconds", time.perf_counter() - started, stage=self.stage)
+        if self.winner is not None:
+            count("hedge_wins_total", stage=self.stage, winner=self.winner_kind)
+            return self.winner
+        if self.primary_error is not None:
+            raise self.primary_error
+        return None
+
+
+def hedged(stage, attempt, on_token=None):
+    """Run attempt(cancelled, on_token), hedging it when it is slow; returns the first valid result or None
+
+    attempt returns its result, or None when the output failed validation. It
+    should raise Cancelled (or simply return) once the cancelled event is set.
+    Only the primary, which runs in the calling thread, streams to on_token.
+    Without HEDGE_REQUESTS the attempt just runs inline.
+    """
+    if not HEDGE_REQUESTS:
+        return attempt(None, on_token)
+    return _Race(stage, attempt, on_token).run()
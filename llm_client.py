@@ -0,0 +1,288 @@
+import contextlib
+import contextvars
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from metrics import count, observe, record_llm_call
+from response_cache import ResponseCache, make_cache_key
+
+# Per-request timeout and retry policy shared by every chat completion
+REQUEST_TIMEOUT = 30.0
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+# Overall budget for one user action (a question or a whole test)
+ACTION_DEADLINE = 90.0
+
+# Connection pool shared by every request from this process
+HTTP_MAX_CONNECTIONS = 64
+HTTP_MAX_KEEPALIVE = 32
+HTTP_KEEPALIVE_EXPIRY = 60.0
+
+# LLM requests in flight at once across the process, so fan-out and hedges wait here instead of timing out on the pool
+LLM_MAX_CONCURRENCY = HTTP_MAX_CONNECTIONS
+
+_client = None
+_client_lock = threading.Lock()
+_llm_slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+
+_deadline = contextvars.ContextVar("llm_deadline", default=None)
+_fresh_samples = contextvars.ContextVar("llm_fresh_samples", default=False)
+
+# Process-wide response cache; set LLM_CACHE_PATH to also persist it to SQLite
+response_cache = ResponseCache(disk_path=os.environ.get("LLM_CACHE_PATH") or None)
+
+
+def create_client(api_key=None, base_url=None):
+    """Build an OpenAI client on a pooled keep-alive HTTP transport"""
+    import httpx
+    import openai
+    from config import get_openai_api_key, get_openai_base_url
+
+    http_client = httpx.Client(
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=REQUEST_TIMEOUT,
+    )
+    return openai.OpenAI(
+        api_key=api_key or get_openai_api_key(),
+        base_url=base_url or get_openai_base_url(),
+        max_retries=0,
+        http_client=http_client,
+    )
+
+
+def get_client():
+    """The process-wide client, created on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = create_client()
+    return _client
+
+
+def set_client(client):
+    """Inject the client used by every generator (e.g. a fake for tests or benchmarks)"""
+    global _client
+    with _client_lock:
+        _client = client
+    return client
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the current action's budget is spent before a call can complete"""
+
+
+@contextlib.contextmanager
+def deadline(seconds):
+    """Bound every LLM call made inside the block to a total time budget"""
+    expires_at = time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None:
+        expires_at = min(expires_at, current)
+    token = _deadline.set(expires_at)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def time_remaining():
+    """Seconds left in the current deadline, or None when no deadline is active"""
+    expires_at = _deadline.get()
+    if expires_at is None:
+        return None
+    return expires_at - time.monotonic()
+
+
+def deadline_expired():
+    remaining = time_remaining()
+    return remaining is not None and remaining <= 0
+
+
+@contextlib.contextmanager
+def fresh_samples():
+    """Send sampled (temperature > 0) calls made inside the block to the model instead of the response cache"""
+    token = _fresh_samples.set(True)
+    try:
+        yield
+    finally:
+        _fresh_samples.reset(token)
+
+
+def submit_with_context(executor, fn, *args, **kwargs):
+    """Submit fn to an executor so it runs under the caller's deadline"""
+    ctx = contextvars.copy_context()
+    return executor.submit(ctx.run, fn, *args, **kwargs)
+
+
+def _retry_after(exc):
+    """Delay requested by the server through Retry-After / retry-after-ms, if any"""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_retryable(exc):
+    status = getattr(exc, "status_code", None)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    try:
+        import openai
+    except ImportError:
+        return False
+    return isinstance(exc, openai.APIConnectionError)
+
+
+def _backoff(attempt):
+    # Full jitter: spread retries from concurrent sessions instead of synchronizing them
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def cache_stats():
+    """Hit/miss counters of the shared response cache"""
+    return response_cache.stats()
+
+
+def chat_completion(client, messages, model, temperature, max_tokens,
+                    timeout=REQUEST_TIMEOUT, max_retries=MAX_RETRIES, use_cache=True, validate=None, **kwargs):
+    """Run one chat completion under the shared retry policy and return the message content
+
+    client may be None to use the process-wide client. With use_cache, repeated requests are answered from the response cache;
+    callers that need a fresh sample every time pass use_cache=False. A new completion is only cached when validate(content),
+    if given, accepts it, so a malformed answer is never served again.
+    """
+    cache_key = None
+    if use_cache:
+        cache_key = make_cache_key(model, messages, temperature, max_tokens, **kwargs)
+        if not (temperature and _fresh_samples.get()):
+            cached = response_cache.get(cache_key, temperature)
+            count("llm_cache_lookups_total", result="miss" if cached is None else "hit")
+            if cached is not None:
+                return cached
+
+    with _llm_slot(model):
+        started = time.perf_counter()
+        response, retries = _send_with_retries(
+            client or get_client(), timeout, max_retries,
+            model=model, messages=messages, temperature=temperature, max_tokens=max_tokens, **kwargs,
+        )
+    record_llm_call(model, time.perf_counter() - started, "ok", retries, getattr(response, "usage", None))
+    content = response.choices[0].message.content or ""
+    if cache_key is not None and content and (validate is None or validate(content)):
+        response_cache.put(cache_key, content, temperature)
+    return content
+
+
+def stream_chat_completion(client, messages, model, temperature, max_tokens,
+                           timeout=REQUEST_TIMEOUT, max_retries=MAX_RETRIES, **kwargs):
+    """Yield the content deltas of a streamed chat completion
+
+    Retries only cover opening the stream; once tokens have been yielded a
+    failure is raised to the caller, which decides what to keep.
+    """
+    # The slot is held until the stream is consumed or closed, as its connection is busy until then
+    with _llm_slot(model):
+        started = time.perf_counter()
+        stream, retries = _send_with_retries(
+            client or get_client(), timeout, max_retries,
+            model=model, messages=messages, temperature=temperature, max_tokens=max_tokens, stream=True,
+            stream_options={"include_usage": True}, **kwargs,
+        )
+        observe("llm_first_byte_seconds", time.perf_counter() - started, model=model)
+        usage = None
+        status = "ok"
+        try:
+            for chunk in stream:
+                # With include_usage the last chunk carries the token counts and no choices
+                usage = getattr(chunk, "usage", None) or usage
+                if chunk.choices:
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        yield delta
+        except GeneratorExit:
+            status = "abandoned"
+            raise
+        except Exception as exc:
+            status = type(exc).__name__
+            raise
+        finally:
+            record_llm_call(model, time.perf_counter() - started, status, retries, usage, stream=True)
+
+
+@contextlib.contextmanager
+def _llm_slot(model):
+    """Hold one of the LLM_MAX_CONCURRENCY request slots, waiting at most until the deadline"""
+    started = time.perf_counter()
+    remaining = time_remaining()
+    if not _llm_slots.acquire(timeout=None if remaining is None else max(remaining, 0)):
+        record_llm_call(model, time.perf_counter() - started, "deadline")
+        raise DeadlineExceeded("action deadline reached while waiting for an LLM request slot")
+    observe("llm_slot_wait_seconds", time.perf_counter() - started, model=model)
+    try:
+        yield
+    finally:
+        _llm_slots.release()
+
+
+def _failure_status(exc):
+    status = getattr(exc, "status_code", None)
+    return str(status) if status is not None else type(exc).__name__
+
+
+def _send_with_retries(client, timeout, max_retries, **create_kwargs):
+    """Return (response, retries); failed calls are recorded here, successful ones by the caller"""
+    model = create_kwargs.get("model")
+    started = time.perf_counter()
+    attempt = 0
+    while True:
+        remaining = time_remaining()
+        if remaining is not None and remaining <= 0:
+            record_llm_call(model, time.perf_counter() - started, "deadline", attempt)
+            raise DeadlineExceeded("action deadline reached before the request was sent")
+        request_timeout = timeout if remaining is None else min(timeout, remaining)
+        try:
+            response = client.with_options(timeout=request_timeout, max_retries=0).chat.completions.create(**create_kwargs)
+            return response, attempt
+        except Exception as exc:
+            count("llm_request_errors_total", model=model, status=_failure_status(exc))
+            if attempt >= max_retries or not _is_retryable(exc):
+                record_llm_call(model, time.perf_counter() - started, _failure_status(exc), attempt)
+                raise
+            delay = _retry_after(exc)
+            if delay is None:
+                delay = _backoff(attempt)
+            remaining = time_remaining()
+            if remaining is not None and delay >= remaining:
+                record_llm_call(model, time.perf_counter() - started, "deadline", attempt)
+                raise DeadlineExceeded("action deadline reached while backing off") from exc
+            time.sleep(delay)
+            attempt += 1
@@ -0,0 +1,319 @@
+"""Spans, counters and histograms for the generation hot path.
+
+Events are emitted as JSON lines on the "arabic_test.metrics" logger and the
+aggregates are rendered in the Prometheus text format. Environment switches:
+
+    METRICS_LOG=path|-          write the JSON events to a file (or stderr)
+    METRICS_FILE=path           rewrite a Prometheus textfile after every action
+    METRICS_PORT=9102           serve /metrics over HTTP
+    PROFILE_GENERATION=1        cProfile each action and dump it under .cache/profiles
+"""
+import contextlib
+import contextvars
+import cProfile
+import io
+import json
+import logging
+import multiprocessing
+import os
+import pstats
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("arabic_test.metrics")
+
+METRICS_FILE = os.environ.get("METRICS_FILE") or None
+PROFILE_GENERATION = os.environ.get("PROFILE_GENERATION") == "1"
+PROFILE_DIR = os.path.join(".cache", "profiles")
+PROFILE_TOP = 25
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_current_span = contextvars.ContextVar("metrics_span", default=None)
+
+
+class Registry:
+    """Thread-safe counters and histograms keyed by metric name and label set, plus gauges computed at render time"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(LATENCY_BUCKETS), 0.0, 0]
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def counters(self):
+        with self._lock:
+            return list(self._counters.items())
+
+    def value(self, name, **labels):
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def histogram_totals(self, name, **labels):
+        """(count, sum) of one histogram"""
+        with self._lock:
+            histogram = self._histograms.get((name, tuple(sorted(labels.items()))))
+            return (histogram[2], histogram[1]) if histogram else (0, 0.0)
+
+    def gauge(self, name, samples):
+        """Render name as a gauge; samples() returns (labels dict, value) pairs when metrics are rendered"""
+        with self._lock:
+            self._gauges[name] = samples
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self):
+        """Prometheus text exposition of every metric"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (list(h[0]), h[1], h[2])) for key, h in self._histograms.items())
+            gauges = sorted(self._gauges.items())
+        lines = []
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{_labels(labels)} {value}")
+        for name, samples in gauges:
+            # Called outside the lock, as gauges are usually derived from counters
+            rows = [(tuple(sorted(labels.items())), value) for labels, value in samples()]
+            if rows:
+                lines.append(f"# TYPE {name} gauge")
+            lines += [f"{name}{_labels(labels)} {value:.6f}" for labels, value in sorted(rows)]
+        for (name, labels), (buckets, total, count) in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            for bound, bucket_count in zip(LATENCY_BUCKETS, buckets):
+                lines.append(f"{name}_bucket{_labels(labels + (('le', repr(bound)),))} {bucket_count}")
+            lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{_labels(labels)} {total:.6f}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+registry = Registry()
+
+
+def count(name, value=1, **labels):
+    registry.inc(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    registry.observe(name, value, **labels)
+
+
+def gauge(name, samples):
+    registry.gauge(name, samples)
+
+
+def log_event(event, **fields):
+    """Emit one structured event, tagged with the current action and span"""
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    current = _current_span.get()
+    if current is not None:
+        fields.setdefault("action_id", current.action_id)
+        fields.setdefault("parent_id", current.span_id)
+    fields.update(event=event, ts=round(time.time(), 3))
+    logger.info(json.dumps(fields, ensure_ascii=False, default=str))
+
+
+class Span:
+    def __init__(self, name, attrs, parent):
+        self.name = name
+        self.attrs = attrs
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.action_id = parent.action_id if parent else self.span_id
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+@contextlib.contextmanager
+def span(name, **attrs):
+    """Time a block, log it as a span and add it to the span_duration_seconds histogram"""
+    parent = _current_span.get()
+    current = Span(name, attrs, parent)
+    token = _current_span.set(current)
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        yield current
+    except BaseException as exc:
+        status = type(exc).__name__
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        _current_span.reset(token)
+        observe("span_duration_seconds", elapsed, span=name)
+        log_event(
+            "span", span=name, span_id=current.span_id, parent_id=current.parent_id, action_id=current.action_id,
+            seconds=round(elapsed, 4), status=status, **current.attrs,
+        )
+        if parent is None and METRICS_FILE:
+            write_metrics_file(METRICS_FILE)
+
+
+def annotate(**attrs):
+    """Attach attributes to the innermost open span, if any"""
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attrs)
+
+
+def record_llm_call(model, seconds, status, retries=0, usage=None, stream=False):
+    """Account one chat completion (including its retries) and log it as an llm_call event"""
+    prompt_tokens = getattr(usage, "prompt_tokens", None)
+    completion_tokens = getattr(usage, "completion_tokens", None)
+    # Prompt tokens the provider served from its prefix cache
+    cached_tokens = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None)
+    count("llm_calls_total", model=model, status=status)
+    if retries:
+        count("llm_retries_total", retries, model=model)
+    if prompt_tokens is not None:
+        count("llm_tokens_total", prompt_tokens, model=model, kind="prompt")
+    if completion_tokens is not None:
+        count("llm_tokens_total", completion_tokens, model=model, kind="completion")
+    if cached_tokens:
+        count("llm_tokens_total", cached_tokens, model=model, kind="cached_prompt")
+    observe("llm_call_seconds", seconds, model=model)
+    log_event(
+        "llm_call", model=model, seconds=round(seconds, 4), status=status, retries=retries, stream=stream,
+        prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, cached_tokens=cached_tokens,
+    )
+
+
+def record_fallback(stage, reason):
+    count("generation_fallbacks_total", stage=stage, reason=reason)
+    log_event("fallback", stage=stage, reason=reason)
+
+
+def record_rejection(stage, reason):
+    count("validation_rejections_total", stage=stage, reason=reason)
+    log_event("rejection", stage=stage, reason=reason)
+
+
+def record_error(stage, exc):
+    count("generation_errors_total", stage=stage, error=type(exc).__name__)
+    log_event("error", stage=stage, error=repr(exc))
+
+
+def render_prometheus():
+    return registry.render()
+
+
+def write_metrics_file(path):
+    """Atomically rewrite a Prometheus textfile (node_exporter textfile collector format)"""
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(render_prometheus())
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def serve_metrics(port, host="127.0.0.1"):
+    """Serve /metrics from a daemon thread; later calls reuse the running server"""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+        return _server
+
+
+@contextlib.contextmanager
+def profiled(name, enabled=None):
+    """cProfile the block (calling thread only) and dump the stats under PROFILE_DIR"""
+    if not (PROFILE_GENERATION if enabled is None else enabled):
+        yield None
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.prof")
+        profiler.dump_stats(path)
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(PROFILE_TOP)
+        log_event("profile", name=name, path=path)
+        logger.debug(summary.getvalue())
+
+
+def configure_from_env():
+    """Attach the log handler and metrics server requested through the environment"""
+    target = os.environ.get("METRICS_LOG")
+    if target and not any(getattr(h, "_metrics_handler", False) for h in logger.handlers):
+        handler = logging.StreamHandler() if target == "-" else logging.FileHandler(target, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        handler._metrics_handler = True
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    port = os.environ.get("METRICS_PORT")
+    # Worker processes (reference extraction, bulk shards) import this module too; only the parent serves
+    if port and multiprocessing.parent_process() is None:
+        serve_metrics(int(port), os.environ.get("METRICS_HOST", "127.0.0.1"))
+
+
+configure_from_env()
@@ -0,0 +1,124 @@
+"""Model tier per call type, with escalation to stronger tiers on invalid output.
+
+Tiers are named models, cheapest first. Each call type starts on its
+configured tier and moves up only when its output fails validation.
+Both can be set from the environment or Streamlit secrets ([models]):
+
+    MODEL_TIER_FAST=gpt-4.1-nano        the model behind a tier
+    MODEL_ROUTE_WORD_LIST=standard      the starting tier of a call type
+"""
+from config import get_model_setting
+from llm_client import chat_completion
+from metrics import count, log_event, registry
+
+TIER_ORDER = ("fast", "standard", "strong")
+
+DEFAULT_TIERS = {
+    "fast": "gpt-4.1-nano",
+    "standard": "gpt-4.1-mini",
+    "strong": "gpt-4.1",
+}
+
+# Short lists and yes/no judgments go to cheap tiers; anything a teacher sees starts on the strong one
+DEFAULT_ROUTES = {
+    "word_list": "fast",
+    "synonym_check": "fast",
+    "verify_choices": "standard",
+    "synonym": "standard",
+    "fallback_choices": "standard",
+    "fallback_mcq": "standard",
+    "word_meaning": "strong",
+    "contextual": "strong",
+    "contextual_batch": "strong",
+}
+
+# USD per million tokens: (input, cached input, output)
+PRICES = {
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1-nano": (0.10, 0.025, 0.40),
+}
+
+
+def tier_model(tier):
+    return get_model_setting(f"MODEL_TIER_{tier}") or DEFAULT_TIERS[tier]
+
+
+def route(call_type):
+    """Starting tier of a call type; unknown call types and tiers fall back to the strong tier"""
+    tier = (get_model_setting(f"MODEL_ROUTE_{call_type}") or DEFAULT_ROUTES.get(call_type, "strong")).strip().lower()
+    return tier if tier in TIER_ORDER else "strong"
+
+
+def model_for(call_type):
+    return tier_model(route(call_type))
+
+
+def escalation(call_type):
+    """Models to try for a call type, from its tier up to the strongest, without repeats"""
+    models = []
+    for tier in TIER_ORDER[TIER_ORDER.index(route(call_type)):]:
+        model = tier_model(tier)
+        if model not in models:
+            models.append(model)
+    return models
+
+
+def record_escalation(call_type, from_model, to_model):
+    count("model_escalations_total", call_type=call_type, from_model=from_model, to_model=to_model)
+    log_event("escalation", call_type=call_type, from_model=from_model, to_model=to_model)
+
+
+def routed_completion(call_type, messages, temperature, max_tokens, validate=None, client=None, **kwargs):
+    """chat_completion on the call type's tier, moving up a tier while validate(content) is false
+
+    Returns the content of the first valid answer, or the last answer when no tier produced a valid one.
+    """
+    models = escalation(call_type)
+    content = ""
+    for i, model in enumerate(models):
+        content = chat_completion(client, messages=messages, model=model, temperature=temperature,
+                                  max_tokens=max_tokens, validate=validate, **kwargs)
+        if validate is None or validate(content):
+            return content
+        if i + 1 < len(models):
+            record_escalation(call_type, model, models[i + 1])
+    return content
+
+
+def cost(model, prompt_tokens, completion_tokens, cached_tokens=0):
+    """USD cost of a call, or 0.0 for models without a known price"""
+    prices = PRICES.get(model)
+    if prices is None:
+        return 0.0
+    uncached = max(prompt_tokens - cached_tokens, 0)
+    return (uncached * prices[0] + cached_tokens * prices[1] + completion_tokens * prices[2]) / 1_000_000
+
+
+def tier_report():
+    """Calls, failure rate, mean latency and cost per tier, from the llm_* metrics"""
+    tiers = {tier_model(tier): tier for tier in reversed(TIER_ORDER)}
+    per_model = {}
+    for (name, labels), value in registry.counters():
+        labels = dict(labels)
+        model = labels.get("model")
+        if model is None or name not in ("llm_calls_total", "llm_tokens_total"):
+            continue
+        row = per_model.setdefault(model, {"calls": 0, "failures": 0, "prompt": 0, "cached_prompt": 0, "completion": 0})
+        if name == "llm_calls_total":
+            row["calls"] += value
+            if labels.get("status") not in ("ok", "abandoned"):
+                row["failures"] += value
+        else:
+            row[labels["kind"]] += value
+    report = {}
+    for model, row in per_model.items():
+        calls, seconds = registry.histogram_totals("llm_call_seconds", model=model)
+        report[tiers.get(model, model)] = {
+            "model": model,
+            "calls": row["calls"],
+            "failure_rate": row["failures"] / row["calls"] if row["calls"] else 0.0,
+            "mean_seconds": seconds / calls if calls else 0.0,
+            "cost_usd": cost(model, row["prompt"], row["completion"], row["cached_prompt"]),
+        }
+    return report
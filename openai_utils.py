@@ -1,8 +1,33 @@
-import openai
+import json
+import os
+import random
 import re
-from config import get_openai_api_key
+import threading
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import arabic_morphology
+from arabic_morphology import pattern_consistency_order
+from arabic_text import compare_key, contains_word, has_al, same_word, split_choice_label, strip_al, without_word
+from distractor_index import get_distractor_index
+from llm_client import chat_completion, stream_chat_completion, deadline_expired, DeadlineExceeded, submit_with_context, get_client
+from metrics import record_error, record_fallback, record_rejection
+from prompt_budget import PromptBudgetExceeded, build_messages
+from reference_index import select_examples
+from dedup_index import DedupIndex, word_key
+from hedging import Cancelled, hedged
+from model_router import escalation, model_for, record_escalation, routed_completion
 
-client = openai.OpenAI(api_key=get_openai_api_key())
+def __getattr__(name):
+    # Backward compatibility for code that imported the old module-level client
+    if name == "client":
+        return get_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Concurrency for generate_meaning_test_llm
+MEANING_TEST_MAX_WORKERS = 8
+# Words asked for per test, and the completion budget for each
+MEANING_TEST_MIN_WORDS = 15
+MEANING_TEST_TOKENS_PER_WORD = 7
 
 # --- Word Meaning MCQ (معاني الكلمات) ---
 PROMPT_HEADER = """
@@ -65,6 +90,47 @@ Examples showing different approaches:
 السرعة
 """
 
+# Static system prompt shared by every word-meaning call; at under 800 tokens it is below the
+# provider's 1024-token prompt-cache minimum, so it is not served from cache
+WORD_MEANING_SYSTEM = PROMPT_HEADER + """
+حاول جعل الخيارات الأربعة لها نفس الوزن الصرفي عند الإمكان، لكن إذا كانت هناك مشتتات تعليمية أفضل بأوزان مختلفة، فاختر القيمة التعليمية.
+الخيارات لا تحتاج لنفس وزن الكلمة الرئيسية - ركز على جعل الخيارات الأربعة متسقة مع بعضها البعض أو ذات قيمة تعليمية عالية.
+**مهم: اتبع نفس استخدام "ال" كما في الكلمة الرئيسية - إذا كانت الكلمة الرئيسية بدون "ال" فالخيارات يجب أن تكون بدون "ال" أيضاً.**
+"""
+
+WORD_MEANING_REQUEST = """الكلمة الرئيسية: "{main_word}"
+أنشئ إجابة صحيحة واحدة (مرادف) وثلاثة مشتتات مناسبة للكلمة "{main_word}".
+**مهم جداً: لا تدرج الكلمة الرئيسية "{main_word}" نفسها في أي من الخيارات.**"""
+
+WORD_MEANING_EXAMPLES = 3
+
+# --- Structured output (JSON schema) for single questions ---
+# The text parsers stay as the compatibility path: STRUCTURED_OUTPUT=0, or a model that rejects response_format
+STRUCTURED_OUTPUT = os.environ.get("STRUCTURED_OUTPUT", "1") == "1"
+
+WORD_MEANING_JSON_INSTRUCTIONS = """
+أعد النتيجة بصيغة JSON فقط بالشكل التالي:
+{"choices": ["كلمة", "كلمة", "كلمة", "كلمة"], "correct": 0}
+- "choices" تحتوي على أربع كلمات مفردة فقط: المرادف الصحيح وثلاثة مشتتات
+- "correct" هو رقم المرادف الصحيح داخل "choices" (من 0 إلى 3)"""
+
+WORD_MEANING_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "word_meaning_choices",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "choices": {"type": "array", "items": {"type": "string"}},
+                "correct": {"type": "integer"},
+            },
+            "required": ["choices", "correct"],
+            "additionalProperties": False,
+        },
+    },
+}
+
 # --- Contextual Word Meaning MCQ (معنى الكلمة حسب السياق) ---
 CONTEXTUAL_PROMPT = """
 أنت خبير في إعداد أسئلة اللغة العربية. أنشئ سؤال اختيار من متعدد لمعنى كلمة في سياق جملة.
@@ -156,45 +222,133 @@ CONTEXTUAL_PROMPT = """
 الإجابة الصحيحة: (أ)
 """
 
-def has_al(word):
-    return word.strip().startswith("ال")
+CONTEXTUAL_SINGLE_REQUEST = "يرجى توليد سؤال واحد فقط بالتنسيق المحدد أعلاه. لا تكتب أي نص تمهيدي."
+
+CHOICE_LETTERS = ['أ', 'ب', 'ج', 'د']
+
+CONTEXTUAL_ITEM_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "sentence": {"type": "string"},
+        "target_word": {"type": "string"},
+        "choices": {"type": "array", "items": {"type": "string"}},
+        "correct": {"type": "string", "enum": CHOICE_LETTERS},
+    },
+    "required": ["sentence", "target_word", "choices", "correct"],
+    "additionalProperties": False,
+}
+
+CONTEXTUAL_SINGLE_JSON_REQUEST = """يرجى توليد سؤال واحد فقط مع اتباع جميع التعليمات أعلاه.
+أعد النتيجة بصيغة JSON فقط بالشكل التالي:
+{"sentence": "الجملة", "target_word": "الكلمة المستهدفة", "choices": ["الخيار أ", "الخيار ب", "الخيار ج", "الخيار د"], "correct": "الحرف"}
+- "choices" تحتوي على أربع كلمات فقط بدون حروف الترقيم (أ، ب، ج، د)
+- "correct" هو حرف الإجابة الصحيحة: أ أو ب أو ج أو د"""
+
+CONTEXTUAL_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "contextual_question", "strict": True, "schema": CONTEXTUAL_ITEM_SCHEMA},
+}
+
+# --- Batched contextual generation (structured output) ---
+CONTEXTUAL_BATCH_INSTRUCTIONS = """
+
+المطلوب الآن: أنشئ {num_questions} أسئلة مختلفة بكلمات مستهدفة مختلفة، مع اتباع جميع التعليمات أعلاه.
+أعد النتيجة بصيغة JSON فقط بالشكل التالي:
+{{"questions": [{{"sentence": "الجملة", "target_word": "الكلمة المستهدفة", "choices": ["الخيار أ", "الخيار ب", "الخيار ج", "الخيار د"], "correct": "الحرف"}}]}}
+- "choices" تحتوي على أربع كلمات فقط بدون حروف الترقيم (أ، ب، ج، د)
+- "correct" هو حرف الإجابة الصحيحة: أ أو ب أو ج أو د
+"""
+
+CONTEXTUAL_BATCH_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "contextual_questions",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "questions": {"type": "array", "items": CONTEXTUAL_ITEM_SCHEMA}
+            },
+            "required": ["questions"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+CONTEXTUAL_BATCH_TOKENS_PER_QUESTION = 250
+CONTEXTUAL_BATCH_MAX_ROUNDS = 3
+CONTEXTUAL_SINGLE_FALLBACK_ATTEMPTS = 3
+
+# --- Synonym verification ---
+# Set VERIFY_CHOICES=1 to check generated choices with verify_choices before serving them
+VERIFY_CHOICES = os.environ.get("VERIFY_CHOICES") == "1"
+
+VERIFY_PROMPT = """For each numbered Arabic pair below, decide whether the candidate is a synonym of (or the closest in meaning to) the word.
+Answer only with JSON of the form {"verdicts": [{"id": 1, "synonym": true}]} covering every id.
+
+"""
+
+VERIFY_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "synonym_verdicts",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "verdicts": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "id": {"type": "integer"},
+                            "synonym": {"type": "boolean"},
+                        },
+                        "required": ["id", "synonym"],
+                        "additionalProperties": False,
+                    },
+                }
+            },
+            "required": ["verdicts"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+# Memoized judgments: (normalized word, normalized candidate) -> is synonym, least recently used dropped first
+SYNONYM_JUDGMENTS_MAX = 10000
+_synonym_judgments = OrderedDict()
+_synonym_judgments_lock = threading.Lock()
 
 def ensure_al(words):
-    return [w if w.startswith("ال") else "ال" + w for w in words]
+    return [w if has_al(w) else "ال" + w for w in words]
 
 def ensure_al_in_choices(choices):
     ensured = []
     for c in choices:
-        m = re.match(r'^([أ-د][\)\-]?)\s*(.+)', c)
-        if m:
-            label, word = m.group(1), m.group(2)
-            if not word.startswith("ال"):
+        label, word = split_choice_label(c)
+        if label:
+            if not has_al(word):
                 word = "ال" + word
-            ensured.append(f"{label} {word}")
+            ensured.append(f"{label}) {word}")
         else:
             ensured.append(c)
     return ensured
 
 def normalize_al(word):
-    return word[2:] if word.startswith("ال") else word
+    return strip_al(word)
 
 def filter_by_length(words):
-    if not words:
-        return []
-    target_len = len(words[0])
-    filtered = [w for w in words if len(w) == target_len]
-    return filtered if len(filtered) >= 4 else words[:4]
+    """Keep the first word plus the three words closest to its pattern (وزن), then letter count"""
+    return pattern_consistency_order(words)[:4]
 
 def share_root(word1, word2):
-    w1 = normalize_al(word1)
-    w2 = normalize_al(word2)
-    return w1[:3] == w2[:3] or w1[:4] == w2[:4]
+    """Check whether two words share a root using the local pattern index"""
+    return arabic_morphology.share_root(word1, word2)
 
 def words_are_same(word1, word2):
-    """Check if two words are the same, considering ال prefix"""
-    w1 = normalize_al(word1.strip())
-    w2 = normalize_al(word2.strip())
-    return w1.lower() == w2.lower()
+    """Check if two words are the same, ignoring ال, diacritics, tatweel and hamza/ى/ة spelling"""
+    return same_word(word1, word2)
 
 def clean_llm_response(response_text):
     """Remove common LLM introductory phrases and clean the response"""
@@ -238,13 +392,13 @@ def normalize_al_consistency(choices, main_word):
         choice = choice.strip()
         
         if main_has_al:
-            if not choice.startswith("ال"):
+            if not has_al(choice):
                 normalized_choices.append("ال" + choice)
             else:
                 normalized_choices.append(choice)
         else:
-            if choice.startswith("ال"):
-                without_al = choice[2:]
+            if has_al(choice):
+                without_al = strip_al(choice)
                 if len(without_al) > 2:
                     normalized_choices.append(without_al)
                 else:
@@ -254,24 +408,123 @@ def normalize_al_consistency(choices, main_word):
     
     return normalized_choices
 
-def is_semantically_related(main_word, candidate, client, model="gpt-4.1"):
+def _judgment_key(main_word, candidate):
+    return compare_key(main_word), compare_key(candidate)
+
+def _known_judgment(key):
+    with _synonym_judgments_lock:
+        verdict = _synonym_judgments.get(key)
+        if verdict is not None:
+            _synonym_judgments.move_to_end(key)
+        return verdict
+
+def _remember_judgment(key, verdict):
+    with _synonym_judgments_lock:
+        _synonym_judgments[key] = verdict
+        _synonym_judgments.move_to_end(key)
+        while len(_synonym_judgments) > SYNONYM_JUDGMENTS_MAX:
+            _synonym_judgments.popitem(last=False)
+
+def _one_word_lines(text, main_word=None):
+    lines = [line.strip() for line in clean_llm_response(text.strip()).split('\n')]
+    return [w for w in lines if w and len(w.split()) == 1 and (main_word is None or not words_are_same(w, main_word))]
+
+def _is_yes_no(answer):
+    return 'نعم' in answer or 'لا' in answer or 'قريب' in answer
+
+def is_semantically_related(main_word, candidate, client=None, model=None):
     """Check if candidate is semantically related to main word"""
+    key = _judgment_key(main_word, candidate)
+    known = _known_judgment(key)
+    if known is not None:
+        return known
     try:
         prompt = f"""In Arabic, is "{normalize_al(candidate)}" a synonym (or the closest in meaning) to "{normalize_al(main_word)}"? Answer only with نعم (yes) or لا (no), or explain if close."""
-        response = client.chat.completions.create(
-            model=model,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0,
-            max_tokens=20,
-        )
-        answer = response.choices[0].message.content.strip()
-        if 'نعم' in answer:
-            return True
-        if 'قريب' in answer and 'لا' not in answer:
-            return True
+        messages = [{"role": "user", "content": prompt}]
+        if model:
+            answer = chat_completion(client, messages=messages, model=model, temperature=0, max_tokens=20,
+                                     validate=_is_yes_no).strip()
+        else:
+            answer = routed_completion("synonym_check", messages, 0, 20, validate=_is_yes_no, client=client).strip()
+        verdict = 'نعم' in answer or ('قريب' in answer and 'لا' not in answer)
+        _remember_judgment(key, verdict)
+        return verdict
+    except Exception as e:
+        record_error("synonym_check", e)
         return False
-    except:
+
+def _verdicts_complete(count):
+    def validate(gpt_output):
+        try:
+            ids = {item.get("id") for item in json.loads(gpt_output).get("verdicts", []) if isinstance(item, dict)}
+        except (ValueError, AttributeError):
+            return False
+        return ids >= set(range(1, count + 1))
+    return validate
+
+def verify_choice_sets(choice_sets, client=None, model=None):
+    """Judge the choices of several questions in one structured call
+
+    choice_sets is a list of (main_word, choices); returns one {choice: is_synonym}
+    dict per set. Pairs judged before are answered from the memo table, and
+    pairs the model could not judge are None (unknown) and not memoized.
+    """
+    results = [{} for _ in choice_sets]
+    pending = {}
+    # The memo is keyed on folded words, but the model must see the words as written (only ال stripped)
+    shown = {}
+    for index, (main_word, choices) in enumerate(choice_sets):
+        for choice in choices:
+            key = _judgment_key(main_word, choice)
+            known = _known_judgment(key)
+            if known is None:
+                pending.setdefault(key, []).append((index, choice))
+                shown.setdefault(key, (normalize_al(main_word.strip()), normalize_al(choice.strip())))
+            else:
+                results[index][choice] = known
+    
+    if not pending:
+        return results
+    
+    keys = list(pending)
+    pairs = "\n".join(f'{i}. الكلمة: "{word}" — المرشح: "{candidate}"' for i, (word, candidate) in enumerate((shown[key] for key in keys), 1))
+    verdicts = {}
+    try:
+        messages = [{"role": "user", "content": VERIFY_PROMPT + pairs}]
+        kwargs = dict(temperature=0, max_tokens=20 * len(keys) + 20, response_format=VERIFY_RESPONSE_FORMAT)
+        if model:
+            gpt_output = chat_completion(client, messages=messages, model=model, validate=_verdicts_complete(len(keys)), **kwargs)
+        else:
+            gpt_output = routed_completion("verify_choices", messages, validate=_verdicts_complete(len(keys)),
+                                           client=client, **kwargs)
+        for item in json.loads(gpt_output).get("verdicts", []):
+            if isinstance(item, dict) and isinstance(item.get("id"), int) and 1 <= item["id"] <= len(keys):
+                verdicts[keys[item["id"] - 1]] = bool(item.get("synonym"))
+    except Exception as e:
+        record_error("verify_choices", e)
+    
+    if len(verdicts) < len(keys):
+        record_fallback("verify_choices", "missing_verdicts")
+    for key, owners in pending.items():
+        verdict = verdicts.get(key)
+        if verdict is not None:
+            _remember_judgment(key, verdict)
+        for index, choice in owners:
+            results[index][choice] = verdict
+    return results
+
+def verify_choices(main_word, choices, client=None, model=None):
+    """Judge every choice of one question in a single call; returns {choice: is_synonym}"""
+    return verify_choice_sets([(main_word, choices)], client, model)[0]
+
+def choices_pass_verification(verdicts, correct_answer, require_correct=True):
+    """True when no distractor is judged a synonym and, if required, the correct answer is not judged otherwise
+
+    Unknown (None) verdicts pass, so a failed verifier call never rejects a question on its own.
+    """
+    if require_correct and verdicts.get(correct_answer) is False:
         return False
+    return not any(verdict for choice, verdict in verdicts.items() if choice != correct_answer)
 
 def extract_candidate_words(gpt_output, main_word):
     """Extract candidate words from GPT output"""
@@ -291,89 +544,187 @@ def extract_candidate_words(gpt_output, main_word):
             word = l.replace('-', '').replace('–', '').replace('—', '').strip()
             # Remove (صحيح) marker if present
             word = word.replace("(صحيح)", "").strip()
-            if word and main_word not in word and len(word.split()) == 1 and word != "الخيارات:":
+            if word and not contains_word(word, main_word) and len(word.split()) == 1 and word != "الخيارات:":
                 words.append(word)
     
     # If no words found with the above method, try alternative parsing
     if not words:
+        record_rejection("extract_candidate_words", "no_choices_section")
         for line in lines:
             word = line.strip().replace('-', '').replace('–', '').replace('—', '').strip()
             word = word.replace("(صحيح)", "").strip()
-            if word and main_word not in word and len(word.split()) == 1 and word != "الخيارات:" and not word.startswith("وزن:"):
+            if word and not contains_word(word, main_word) and len(word.split()) == 1 and word != "الخيارات:" and not word.startswith("وزن:"):
                 words.append(word)
     
     return words
 
-def generate_fallback_choices(main_word, client):
+def generate_fallback_choices(main_word, client=None):
     """Generate fallback choices when the main prompt fails"""
     try:
         prompt = f"""Generate 4 Arabic words for MCQ about "{main_word}". First word should be a synonym, other 3 should be different meanings. Use the same form (with or without ال) as the main word. List one word per line, no explanations."""
-        response = client.chat.completions.create(
-            model="gpt-4.1",
-            messages=[{"role": "user", "content": prompt}],
+        gpt_output = routed_completion(
+            "fallback_choices",
+            [{"role": "user", "content": prompt}],
             temperature=0.7,
             max_tokens=100,
+            validate=lambda text: len(_one_word_lines(text)) >= 4,
+            client=client,
         )
         words = []
-        for line in response.choices[0].message.content.strip().split('\n'):
+        for line in gpt_output.strip().split('\n'):
             word = line.strip()
             if word and len(word.split()) == 1:
                 words.append(word)
         return words[:4]
-    except:
+    except Exception as e:
+        record_error("fallback_choices", e)
         return []
 
-def generate_mcq_arabic_word_meaning(main_word, reference_questions, grade):
-    prompt = f"""{PROMPT_HEADER}
-الكلمة الرئيسية: "{main_word}"
-الأسئلة المرجعية: {reference_questions[:3]}
+def _structured_output_unsupported(exc):
+    # A 400 on a response_format request means the model or endpoint has no JSON-schema mode
+    return getattr(exc, "status_code", None) == 400
 
-أنشئ إجابة صحيحة واحدة (مرادف) وثلاثة مشتتات مناسبة للكلمة "{main_word}".
-حاول جعل الخيارات الأربعة لها نفس الوزن الصرفي عند الإمكان، لكن إذا كانت هناك مشتتات تعليمية أفضل بأوزان مختلفة، فاختر القيمة التعليمية.
-الخيارات لا تحتاج لنفس وزن الكلمة الرئيسية - ركز على جعل الخيارات الأربعة متسقة مع بعضها البعض أو ذات قيمة تعليمية عالية.
-**مهم جداً: لا تدرج الكلمة الرئيسية "{main_word}" نفسها في أي من الخيارات.**
-**مهم: اتبع نفس استخدام "ال" كما في الكلمة الرئيسية - إذا كانت الكلمة الرئيسية بدون "ال" فالخيارات يجب أن تكون بدون "ال" أيضاً.**
-"""
+def _word_meaning_messages(main_word, reference_questions, structured):
+    request = WORD_MEANING_REQUEST.format(main_word=main_word)
+    if structured:
+        request += "\n" + WORD_MEANING_JSON_INSTRUCTIONS
+    return build_messages(
+        WORD_MEANING_SYSTEM,
+        request,
+        select_examples(reference_questions, main_word, WORD_MEANING_EXAMPLES),
+        examples_header="الأسئلة المرجعية:",
+        stage="word_meaning",
+    )
+
+def parse_word_meaning_text(gpt_output):
+    """Return (correct_answer, choices) from the free-text format with "الخيارات:" and "(صحيح)" markers"""
+    cleaned_output = clean_llm_response(gpt_output.strip())
+    correct_answer = None
+    all_choices = []
+    collecting_choices = False
+    
+    for line in cleaned_output.split('\n'):
+        line = line.strip()
+        if line.startswith("الخيارات:"):
+            collecting_choices = True
+            continue
+        elif collecting_choices and line:
+            if "(صحيح)" in line:
+                correct_answer = line.replace("(صحيح)", "").strip()
+                all_choices.append(correct_answer)
+            elif line and not line.startswith("الكلمة") and not line.startswith("وزن"):
+                all_choices.append(line)
     
+    return correct_answer, all_choices
+
+def parse_word_meaning_json(gpt_output):
+    """Return (correct_answer, choices) from a word_meaning_choices object, or (None, None) if it fails validation"""
     try:
-        response = client.chat.completions.create(
-            model="gpt-4.1",
-            messages=[{"role": "user", "content": prompt}],
+        data = json.loads(gpt_output)
+    except ValueError:
+        record_rejection("word_meaning_json", "invalid_json")
+        return None, None
+    choices = data.get("choices") if isinstance(data, dict) else None
+    if not isinstance(choices, list) or len(choices) != 4 or not all(isinstance(c, str) and c.strip() for c in choices):
+        record_rejection("word_meaning_json", "bad_choices")
+        return None, None
+    correct = data.get("correct")
+    if not isinstance(correct, int) or isinstance(correct, bool) or not 0 <= correct < 4:
+        record_rejection("word_meaning_json", "bad_correct_index")
+        return None, None
+    choices = [c.replace("(صحيح)", "").strip() for c in choices]
+    return choices[correct], choices
+
+def _parsed_completion(parse, accept, cancelled=None, **kwargs):
+    """parse() of a chat_completion answer; the answer is only cached when accept(parsed) is true
+
+    Inside a hedged race (cancelled given) the answer is streamed instead, so
+    the primary, which runs in the caller's thread, stops as soon as a copy wins.
+    """
+    if cancelled is not None:
+        return parse(_stream_text(on_token=lambda text: None, cancelled=cancelled, **kwargs))
+    parsed = {}
+    
+    def validate(text):
+        parsed[text] = parse(text)
+        return accept(parsed[text])
+    
+    gpt_output = chat_completion(get_client(), validate=validate, **kwargs)
+    return parsed[gpt_output] if gpt_output in parsed else parse(gpt_output)
+
+def _hedged_with_escalation(call_type, attempt, on_token=None):
+    """hedged() attempt(model, cancelled, on_token) on the call type's tier, then on each stronger tier while it fails validation"""
+    models = escalation(call_type)
+    for i, model in enumerate(models):
+        result = hedged(call_type, lambda cancelled, on_token, model=model: attempt(model, cancelled, on_token), on_token)
+        if result is not None:
+            return result
+        if i + 1 < len(models):
+            record_escalation(call_type, model, models[i + 1])
+    return None
+
+def _request_word_meaning_choices(main_word, reference_questions):
+    """Ask for the four choices, as a JSON object when STRUCTURED_OUTPUT is on; returns (correct_answer, choices)
+
+    With HEDGE_REQUESTS a slow request is raced against a parallel copy and the
+    first parse that passes validation is used.
+    """
+    if STRUCTURED_OUTPUT:
+        messages = _word_meaning_messages(main_word, reference_questions, structured=True)
+        
+        def attempt(model, cancelled, on_token):
+            correct_answer, all_choices = _parsed_completion(
+                parse_word_meaning_json,
+                lambda parsed: parsed[1] is not None,
+                cancelled,
+                model=model,
+                messages=messages,
+                temperature=0.6,
+                max_tokens=150,
+                response_format=WORD_MEANING_RESPONSE_FORMAT,
+            )
+            return (correct_answer, all_choices) if all_choices is not None else None
+        
+        try:
+            return _hedged_with_escalation("word_meaning", attempt) or (None, None)
+        except Exception as e:
+            if not _structured_output_unsupported(e):
+                raise
+            record_fallback("word_meaning", "text_mode")
+    
+    messages = _word_meaning_messages(main_word, reference_questions, structured=False)
+    
+    def attempt(model, cancelled, on_token):
+        correct_answer, all_choices = _parsed_completion(
+            parse_word_meaning_text,
+            lambda parsed: bool(parsed[0]),
+            cancelled,
+            model=model,
+            messages=messages,
             temperature=0.6,
             max_tokens=300,
         )
-        
-        gpt_output = response.choices[0].message.content.strip()
-        cleaned_output = clean_llm_response(gpt_output)
-        
-        # Extract choices and identify correct answer
-        correct_answer = None
-        all_choices = []
-        
-        lines = cleaned_output.split('\n')
-        collecting_choices = False
-        
-        for line in lines:
-            line = line.strip()
-            if line.startswith("الخيارات:"):
-                collecting_choices = True
-                continue
-            elif collecting_choices and line:
-                if "(صحيح)" in line:
-                    correct_answer = line.replace("(صحيح)", "").strip()
-                    all_choices.append(correct_answer)
-                elif line and not line.startswith("الكلمة") and not line.startswith("وزن"):
-                    all_choices.append(line)
+        return (correct_answer, all_choices) if correct_answer else None
+    
+    return _hedged_with_escalation("word_meaning", attempt) or (None, [])
+
+def generate_mcq_arabic_word_meaning(main_word, reference_questions, grade):
+    try:
+        correct_answer, all_choices = _request_word_meaning_choices(main_word, reference_questions)
+        if all_choices is None:
+            # The structured parser already recorded why the object was rejected
+            return generate_fallback_mcq(main_word, reference_questions=reference_questions)
         
         # Filter out the main word from all choices
-        all_choices = [choice for choice in all_choices if not words_are_same(choice, main_word)]
+        all_choices = without_word(all_choices, main_word)
         
         if correct_answer and words_are_same(correct_answer, main_word):
             correct_answer = None
         
         # Fallback if parsing fails or main word was included
         if not correct_answer or len(all_choices) < 4:
-            return generate_fallback_mcq(main_word, client)
+            record_rejection("word_meaning", "too_few_choices" if correct_answer else "no_correct_marker")
+            return generate_fallback_mcq(main_word, reference_questions=reference_questions)
         
         # Apply proper ال consistency based on main word
         all_choices = normalize_al_consistency(all_choices, main_word)
@@ -386,6 +737,10 @@ def generate_mcq_arabic_word_meaning(main_word, reference_questions, grade):
         if len(filtered_choices) < 4:
             filtered_choices = all_choices[:4]
         
+        # Prefer distractors that share the correct answer's pattern and letter count
+        if correct_answer in filtered_choices:
+            filtered_choices = filter_by_length([correct_answer] + [c for c in filtered_choices if c != correct_answer])
+        
         choices = filtered_choices[:4]
         
         # Find correct answer in filtered choices
@@ -396,13 +751,17 @@ def generate_mcq_arabic_word_meaning(main_word, reference_questions, grade):
             correct_answer = choices[0]
         
         # Final check to ensure main word is not in choices
-        choices = [choice for choice in choices if not words_are_same(choice, main_word)]
+        choices = without_word(choices, main_word)
         
         if len(choices) < 4:
-            return generate_fallback_mcq(main_word, client)
+            record_rejection("word_meaning", "main_word_in_choices")
+            return generate_fallback_mcq(main_word, reference_questions=reference_questions)
+        
+        if VERIFY_CHOICES and not choices_pass_verification(verify_choices(main_word, choices), correct_answer):
+            record_rejection("word_meaning", "synonym_distractor")
+            return generate_fallback_mcq(main_word, reference_questions=reference_questions)
         
         # Shuffle choices but keep track of correct answer position
-        import random
         random.shuffle(choices)
         correct_index = choices.index(correct_answer)
         
@@ -415,11 +774,65 @@ def generate_mcq_arabic_word_meaning(main_word, reference_questions, grade):
         
         return question, answer, None
         
+    except DeadlineExceeded as e:
+        record_error("word_meaning", e)
+        return None, None, "انتهى الوقت المخصص لتوليد السؤال"
     except Exception as e:
-        return generate_fallback_mcq(main_word, client)
+        record_error("word_meaning", e)
+        return generate_fallback_mcq(main_word, reference_questions=reference_questions)
 
-def generate_fallback_mcq(main_word, client):
+def generate_synonym_mcq(main_word, client, reference_questions):
+    """Ask the model only for the synonym and draw the three distractors from the reference corpus"""
+    index = get_distractor_index(reference_questions)
+    if index.size < 3:
+        record_rejection("synonym_only", "small_corpus")
+        return None, None, None
+    
+    prompt = f"""اكتب مرادفًا واحدًا صحيحًا للكلمة العربية "{main_word}".
+اتبع نفس استخدام "ال" كما في الكلمة الرئيسية، ولا تكتب الكلمة الرئيسية نفسها.
+اكتب الكلمة فقط بدون أي نص آخر."""
+    try:
+        gpt_output = routed_completion(
+            "synonym",
+            [{"role": "user", "content": prompt}],
+            temperature=0.3,
+            max_tokens=20,
+            validate=lambda text: bool(_one_word_lines(text, main_word)),
+            client=client,
+        )
+    except Exception as e:
+        record_error("synonym_only", e)
+        return None, None, None
+    
+    lines = [l.strip() for l in clean_llm_response(gpt_output.strip()).split('\n') if l.strip()]
+    synonym = lines[0].replace("(صحيح)", "").strip(' ."\'«»') if lines else ""
+    if not synonym or len(synonym.split()) != 1 or words_are_same(synonym, main_word):
+        record_rejection("synonym_only", "invalid_synonym")
+        return None, None, None
+    synonym = normalize_al_consistency([synonym], main_word)[0]
+    
+    distractors = index.sample(synonym, 3, exclude=[main_word])
+    if len(distractors) < 3:
+        record_rejection("synonym_only", "too_few_distractors")
+        return None, None, None
+    
+    choices = [synonym] + distractors
+    random.shuffle(choices)
+    display_choices = [f"{CHOICE_LETTERS[i]}) {choices[i]}" for i in range(4)]
+    question = f"ما معنى كلمة \"{main_word}\"؟\n\n" + "\n".join(display_choices)
+    answer = display_choices[choices.index(synonym)]
+    
+    return question, answer, "تم استخدام خيارات احتياطية لضمان توليد السؤال."
+
+def generate_fallback_mcq(main_word, client=None, reference_questions=None):
     """Generate fallback MCQ when main prompt fails"""
+    # The LLM only has to supply the synonym when the corpus can provide distractors
+    if reference_questions:
+        question, answer, msg = generate_synonym_mcq(main_word, client, reference_questions)
+        if question and answer:
+            record_fallback("word_meaning", "synonym_only")
+            return question, answer, msg
+    
     try:
         prompt = f"""
         للكلمة العربية "{main_word}":
@@ -432,14 +845,16 @@ def generate_fallback_mcq(main_word, client):
         لا تكتب أي نص تمهيدي.
         """
         
-        response = client.chat.completions.create(
-            model="gpt-4.1",
-            messages=[{"role": "user", "content": prompt}],
+        gpt_output = routed_completion(
+            "fallback_mcq",
+            [{"role": "user", "content": prompt}],
             temperature=0.7,
             max_tokens=150,
+            validate=lambda text: len(_one_word_lines(text, main_word)) >= 4,
+            client=client,
         )
         
-        cleaned_output = clean_llm_response(response.choices[0].message.content.strip())
+        cleaned_output = clean_llm_response(gpt_output.strip())
         words = []
         for line in cleaned_output.split('\n'):
             word = line.strip()
@@ -449,14 +864,22 @@ def generate_fallback_mcq(main_word, client):
         # Apply ال consistency
         words = normalize_al_consistency(words, main_word)
         
+        fallback_reason = "four_words"
+        if len(words) < 4 and reference_questions:
+            fallback_reason = "corpus_fill"
+            # Fill missing distractors from the reference corpus before the fixed word list
+            anchor = words[0] if words else main_word
+            words.extend(get_distractor_index(reference_questions).sample(anchor, 4 - len(words), exclude=[main_word] + words))
+        
         if len(words) < 4:
+            fallback_reason = "fixed_words"
             # Ultimate fallback with proper ال handling
             if has_al(main_word):
                 fallback_words = ["الفهم", "الجهل", "السرعة", "القوة"]
             else:
                 fallback_words = ["فهم", "جهل", "سرعة", "قوة"]
             
-            fallback_words = [w for w in fallback_words if not words_are_same(w, main_word)]
+            fallback_words = without_word(fallback_words, main_word)
             words.extend(fallback_words)
         
         choices = words[:4]
@@ -464,49 +887,145 @@ def generate_fallback_mcq(main_word, client):
         display_choices = [f"{letters[i]}) {choices[i]}" for i in range(4)]
         question = f"ما معنى كلمة \"{main_word}\"؟\n\n" + "\n".join(display_choices)
         answer = display_choices[0]
+        record_fallback("word_meaning", fallback_reason)
         
         return question, answer, "تم استخدام خيارات احتياطية لضمان توليد السؤال."
         
     except Exception as e:
+        record_error("fallback_mcq", e)
         return None, None, "فشل في توليد السؤال"
 
-def generate_meaning_test_llm(num_questions, reference_questions, grade):
-    questions = []
+def reshuffle_choices(question, answer):
+    """The same word-meaning question with its choices in a new random order and relabelled"""
+    if not question or not answer:
+        return question, answer
+    header, _, body = question.partition("\n\n")
+    labelled = [split_choice_label(line) for line in body.split('\n')]
+    choices = [word for _, word in labelled]
+    correct = split_choice_label(answer)[1]
+    if len(choices) != len(CHOICE_LETTERS) or any(label is None for label, _ in labelled) or correct not in choices:
+        return question, answer
+    random.shuffle(choices)
+    display_choices = [f"{CHOICE_LETTERS[i]}) {choices[i]}" for i in range(4)]
+    return f"{header}\n\n" + "\n".join(display_choices), display_choices[choices.index(correct)]
+
+_QUESTION_WORD = re.compile(r'ما معنى كلمة "([^"]+)"')
+
+def claim_meaning_question(dedup, question):
+    """Record the main word of a formatted word-meaning question; False if the scope already used it"""
+    match = _QUESTION_WORD.search(question or "")
+    return bool(match) and dedup.claim_word(match.group(1))
+
+def contextual_question_parts(question):
+    """(sentence, target_word) of a question formatted by format_contextual_question"""
+    lines = [line.strip() for line in (question or "").split('\n') if line.strip()]
+    sentence = lines[1] if len(lines) > 1 and lines[0] == "السؤال:" else ""
+    match = _QUESTION_WORD.search(question or "")
+    return sentence, match.group(1) if match else ""
+
+def claim_contextual_question(dedup, question):
+    """Record the target word and sentence of a contextual question; False if either was already used"""
+    sentence, target_word = contextual_question_parts(question)
+    if not sentence or not target_word:
+        return False
+    if dedup.seen_sentence(sentence):
+        record_rejection("contextual_test", "duplicate_sentence")
+        return False
+    if not dedup.claim_word(target_word):
+        record_rejection("contextual_test", "duplicate_target_word")
+        return False
+    dedup.claim_sentence(sentence)
+    return True
+
+def _exclusion_clause(words):
+    return "لا تستخدم الكلمات التالية: " + "، ".join(words) if words else ""
+
+def iter_meaning_test_llm(num_questions, reference_questions, grade, dedup=None):
+    """Yield (question, answer, msg) tuples for a word-meaning test as soon as each one is ready
+
+    dedup is a DedupIndex for the teacher/session; its words are excluded in
+    the prompt, skipped before any call is made and recorded as questions are accepted.
+    """
+    dedup = dedup or DedupIndex(None, path=None)
     used_words = set()
-    max_attempts = num_questions * 10
-    attempts = 0
+    # Room for duplicates and failed words, however long the test
+    word_count = max(MEANING_TEST_MIN_WORDS, 2 * num_questions)
     
     # Updated prompt to avoid introductory text
     prompt = (
-        f"اكتب 15 كلمة عربية مناسبة لاختبار معاني الكلمات للصف {grade}. "
+        f"اكتب {word_count} كلمة عربية مناسبة لاختبار معاني الكلمات للصف {grade}. "
         "كل كلمة في سطر منفصل. لا تكتب أي نص تمهيدي أو تفسيري."
     )
+    excluded = _exclusion_clause(dedup.excluded_words())
+    if excluded:
+        prompt += " " + excluded
     
     try:
-        response = client.chat.completions.create(
-            model="gpt-4.1",
-            messages=[{"role": "user", "content": prompt}],
+        # A short list is the cheap tier's job; a stronger tier is asked only if too few words come back
+        gpt_output = routed_completion(
+            "word_list",
+            [{"role": "user", "content": prompt}],
             temperature=0.7,
-            max_tokens=100,
+            max_tokens=MEANING_TEST_TOKENS_PER_WORD * word_count,
+            validate=lambda text: len(_one_word_lines(text)) >= num_questions,
+            client=get_client(),
+            use_cache=False,
         )
         
-        cleaned_output = clean_llm_response(response.choices[0].message.content.strip())
+        cleaned_output = clean_llm_response(gpt_output.strip())
         candidate_words = [w.strip() for w in cleaned_output.split('\n') if w.strip()]
-        
-        for main_word in candidate_words:
-            if len(questions) >= num_questions:
-                break
-            if main_word in used_words:
-                continue
-            used_words.add(main_word)
-            q, a, msg = generate_mcq_arabic_word_meaning(main_word, reference_questions, grade)
-            if q and a:
-                questions.append((q, a, msg))
-        
-        return questions
-        
     except Exception as e:
-        return []
+        record_error("meaning_test_words", e)
+        return
+    
+    unique_words = []
+    for main_word in candidate_words:
+        key = word_key(main_word)
+        if key and key not in used_words and not dedup.seen_word(main_word):
+            used_words.add(key)
+            unique_words.append(main_word)
+    
+    if not unique_words:
+        record_rejection("meaning_test_words", "empty_word_list")
+        return
+    
+    # One generation per question; a spare word is started only when one fails or repeats a used word
+    words = iter(unique_words)
+    executor = ThreadPoolExecutor(max_workers=min(num_questions, MEANING_TEST_MAX_WORKERS))
+    pending = set()
+    
+    def start_next_word():
+        main_word = next(words, None)
+        if main_word is not None and not deadline_expired():
+            pending.add(submit_with_context(executor, generate_mcq_arabic_word_meaning, main_word, reference_questions, grade))
+    
+    for _ in range(num_questions):
+        start_next_word()
+    produced = 0
+    try:
+        while pending and produced < num_questions:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.discard(future)
+                try:
+                    q, a, msg = future.result()
+                except Exception as e:
+                    record_error("meaning_test", e)
+                    q = a = None
+                if q and a and not claim_meaning_question(dedup, q):
+                    record_rejection("meaning_test", "duplicate_word")
+                    q = a = None
+                if q and a and produced < num_questions:
+                    yield q, a, msg
+                    produced += 1
+                else:
+                    start_next_word()
+    finally:
+        # In-flight calls of an abandoned test finish in the background
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def generate_meaning_test_llm(num_questions, reference_questions, grade, dedup=None):
+    return list(iter_meaning_test_llm(num_questions, reference_questions, grade, dedup))
 
 # --- Contextual Word Meaning MCQ (معنى الكلمة حسب السياق) ---
 def parse_contextual_response(gpt_output):
@@ -530,7 +1049,7 @@ def parse_contextual_response(gpt_output):
                 match = re.search(r'"([^"]+)"', line)
                 if match:
                     target_word = match.group(1)
-            elif re.match(r'^[أ-د][\)\s]', line):
+            elif split_choice_label(line)[0]:
                 choices.append(line)
             elif line.startswith("الإجابة الصحيحة:"):
                 match = re.search(r'\(([أ-د])\)', line)
@@ -540,26 +1059,22 @@ def parse_contextual_response(gpt_output):
             i += 1
         
         return question_sentence, target_word, choices, correct_answer
-    except:
+    except Exception as e:
+        record_error("parse_contextual_response", e)
         return "", "", [], ""
 
 def format_contextual_question(question_sentence, target_word, choices, correct_answer):
     """Format the contextual question properly with line breaks and ال consistency"""
     if not all([question_sentence, target_word, choices, correct_answer]):
+        record_rejection("format_contextual_question", "incomplete")
         return None, None
     
     try:
         # Filter out target word from choices
-        filtered_choices = []
-        for choice in choices:
-            choice_word = choice
-            if re.match(r'^[أ-د][\)\-]', choice):
-                choice_word = re.sub(r'^[أ-د][\)\-]\s*', '', choice)
-            
-            if not words_are_same(choice_word, target_word):
-                filtered_choices.append(choice)
+        filtered_choices = [choice for choice in choices if not words_are_same(split_choice_label(choice)[1], target_word)]
         
         if len(filtered_choices) < 4:
+            record_rejection("format_contextual_question", "target_word_in_choices")
             return None, None
         
         # Apply ال consistency to contextual choices based on target word
@@ -567,10 +1082,15 @@ def format_contextual_question(question_sentence, target_word, choices, correct_
         choice_labels = []
         
         for choice in filtered_choices[:4]:
-            match = re.match(r'^([أ-د][\)\-]?)\s*(.+)', choice)
-            if match:
-                choice_labels.append(match.group(1))
-                choice_words.append(match.group(2))
+            label, word = split_choice_label(choice)
+            if label and word:
+                choice_labels.append(label)
+                choice_words.append(word)
+        
+        # The answer letter must point at one of four listed choices
+        if sorted(choice_labels) != sorted(CHOICE_LETTERS) or correct_answer not in choice_labels:
+            record_rejection("format_contextual_question", "missing_choice")
+            return None, None
         
         # Apply ال consistency
         normalized_choice_words = normalize_al_consistency(choice_words, target_word)
@@ -593,59 +1113,290 @@ def format_contextual_question(question_sentence, target_word, choices, correct_
         
         return formatted_question.strip(), formatted_answer
         
-    except:
+    except Exception as e:
+        record_error("format_contextual_question", e)
+        return None, None
+
+def _stream_text(messages, model, temperature, max_tokens, on_token, preview=None, cancelled=None, **kwargs):
+    """Stream a completion, passing the text received so far (through preview, if given) to on_token, and return the full text
+
+    Raises Cancelled, closing the stream, as soon as the cancelled event is set.
+    """
+    text = ""
+    on_token(text)
+    for delta in stream_chat_completion(get_client(), messages=messages, model=model, temperature=temperature, max_tokens=max_tokens, **kwargs):
+        if cancelled is not None and cancelled.is_set():
+            raise Cancelled()
+        text += delta
+        on_token(preview(text) if preview else text)
+    return text
+
+_JSON_STRING = r'"((?:[^"\\]|\\.)*)'
+
+def contextual_json_preview(text):
+    """Readable rendering of a partially streamed contextual_question object"""
+    lines = []
+    sentence = re.search(r'"sentence"\s*:\s*' + _JSON_STRING, text)
+    if sentence:
+        lines.append(sentence.group(1))
+    target = re.search(r'"target_word"\s*:\s*' + _JSON_STRING + '"', text)
+    if target:
+        lines += ["", f"ما معنى كلمة \"{target.group(1)}\" في السياق أعلاه؟", ""]
+    choices = re.search(r'"choices"\s*:\s*\[([^\]]*)', text)
+    if choices:
+        found = re.findall(_JSON_STRING + '"', choices.group(1))
+        lines += [f"{CHOICE_LETTERS[i]}) {choice}" for i, choice in enumerate(found[:4])]
+    return "\n".join(lines)
+
+def _contextual_attempt_structured(messages, on_token, cancelled=None, model="gpt-4.1"):
+    """One structured contextual attempt; returns (question, answer_line), (None, None) when rejected"""
+    kwargs = dict(model=model, temperature=0.6, max_tokens=400, response_format=CONTEXTUAL_RESPONSE_FORMAT)
+    if on_token:
+        gpt_output = _stream_text(messages, on_token=on_token, preview=contextual_json_preview, cancelled=cancelled, **kwargs)
+    else:
+        gpt_output = chat_completion(get_client(), messages=messages, use_cache=False, **kwargs)
+    try:
+        item = json.loads(gpt_output)
+    except ValueError:
+        record_rejection("contextual_json", "invalid_json")
+        return None, None
+    return validate_contextual_item(item, stage="contextual_json")
+
+def _contextual_attempt_text(messages, on_token, cancelled=None, model="gpt-4.1"):
+    """One free-text contextual attempt parsed with parse_contextual_response"""
+    if on_token:
+        gpt_output = _stream_text(messages, model, 0.6, 400, on_token, cancelled=cancelled).strip()
+    else:
+        gpt_output = chat_completion(
+            get_client(),
+            model=model,
+            messages=messages,
+            temperature=0.6,
+            max_tokens=400,
+            use_cache=False,
+        ).strip()
+    
+    question_sentence, target_word, choices, correct_answer = parse_contextual_response(gpt_output)
+    
+    # Validate we have all required components
+    if not all([question_sentence, target_word, choices, correct_answer]) or len(choices) < 4:
+        record_rejection("parse_contextual_response", _contextual_parse_failure(question_sentence, target_word, choices, correct_answer))
         return None, None
+    
+    return format_contextual_question(question_sentence, target_word, choices, correct_answer)
 
-def generate_mcq_contextual_word_meaning(reference_questions, grade):
-    prompt = CONTEXTUAL_PROMPT + "\n\nيرجى توليد سؤال واحد فقط بالتنسيق المحدد أعلاه. لا تكتب أي نص تمهيدي."
+def _contextual_parse_failure(question_sentence, target_word, choices, correct_answer):
+    """Why a parsed contextual response was rejected, for the rejection metrics"""
+    if not question_sentence:
+        return "missing_sentence"
+    if not target_word:
+        return "missing_target_word"
+    if not correct_answer:
+        return "missing_answer"
+    return "too_few_choices"
+
+def generate_mcq_contextual_word_meaning(reference_questions, grade, on_token=None, exclude_words=()):
+    """Generate one contextual MCQ; on_token, if given, receives the text as it streams in"""
+    structured = STRUCTURED_OUTPUT
+    excluded = _exclusion_clause(exclude_words)
+    # Each rejected attempt moves one tier up, if the contextual route starts below the strongest
+    models = escalation("contextual")
     
     max_retries = 5
     for attempt in range(max_retries):
+        model = models[min(attempt, len(models) - 1)]
+        if attempt and model != models[min(attempt - 1, len(models) - 1)]:
+            record_escalation("contextual", models[attempt - 1], model)
+        # CONTEXTUAL_PROMPT is the unchanged system message; only the request varies between attempts
+        request = CONTEXTUAL_SINGLE_JSON_REQUEST if structured else CONTEXTUAL_SINGLE_REQUEST
+        if excluded:
+            request += "\n" + excluded
         try:
-            response = client.chat.completions.create(
-                model="gpt-4.1",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.6,
-                max_tokens=400,
-            )
-            
-            gpt_output = response.choices[0].message.content.strip()
-            
-            # Parse the response
-            question_sentence, target_word, choices, correct_answer = parse_contextual_response(gpt_output)
-            
-            # Validate we have all required components
-            if not all([question_sentence, target_word, choices, correct_answer]) or len(choices) < 4:
-                continue
-            
-            # Format the question properly
-            formatted_question, formatted_answer = format_contextual_question(
-                question_sentence, target_word, choices, correct_answer
-            )
-            
-            if formatted_question and formatted_answer:
-                return formatted_question, formatted_answer
+            messages = build_messages(CONTEXTUAL_PROMPT, request, stage="contextual")
+        except PromptBudgetExceeded:
+            # Every later attempt would send the same fixed text
+            record_rejection("contextual", "prompt_budget")
+            break
+        attempt_fn = _contextual_attempt_structured if structured else _contextual_attempt_text
+        
+        def run_attempt(cancelled, on_token, attempt_fn=attempt_fn, messages=messages, model=model):
+            question, answer_line = attempt_fn(messages, on_token, cancelled, model)
+            return (question, answer_line) if question and answer_line else None
+        
+        try:
+            # With HEDGE_REQUESTS a slow attempt is raced against a parallel copy
+            result = hedged("contextual", run_attempt, on_token)
+            if result:
+                return result
                 
         except Exception as e:
-            continue
+            if structured and _structured_output_unsupported(e):
+                record_fallback("contextual", "text_mode")
+                structured = False
+                continue
+            # Transport errors were already retried by chat_completion; another attempt won't help
+            record_error("contextual", e)
+            break
     
     return None, None
 
-def generate_contextual_test_llm(num_questions, reference_questions, grade):
-    questions = []
-    max_attempts = num_questions * 30
-    attempts = 0
+def validate_contextual_item(item, stage="contextual_batch"):
+    """Validate one structured contextual item with the same rules as the text path"""
+    if not isinstance(item, dict):
+        record_rejection(stage, "not_an_object")
+        return None, None
+    question_sentence = str(item.get("sentence", "")).strip()
+    target_word = str(item.get("target_word", "")).strip()
+    correct_answer = str(item.get("correct", "")).strip()
+    raw_choices = item.get("choices") or []
+    if not isinstance(raw_choices, list) or len(raw_choices) != 4 or not all(isinstance(c, str) and c.strip() for c in raw_choices):
+        record_rejection(stage, "bad_choices")
+        return None, None
+    if correct_answer not in CHOICE_LETTERS:
+        record_rejection(stage, "bad_correct_letter")
+        return None, None
+    choices = [f"{CHOICE_LETTERS[i]}) {str(c).strip()}" for i, c in enumerate(raw_choices)]
+    return format_contextual_question(question_sentence, target_word, choices, correct_answer)
+
+def iter_json_array_items(chunks):
+    """Yield each object of the first array in a streamed JSON document as soon as it closes"""
+    buffer = ""
+    depth = 0
+    in_string = False
+    escaped = False
+    item_start = None
+    array_depth = None
+    for chunk in chunks:
+        offset = len(buffer)
+        buffer += chunk
+        for i in range(offset, len(buffer)):
+            ch = buffer[i]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif ch == "\\":
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+                continue
+            if ch == '"':
+                in_string = True
+            elif ch in "{[":
+                depth += 1
+                if ch == "[" and array_depth is None:
+                    array_depth = depth
+                elif ch == "{" and array_depth is not None and depth == array_depth + 1:
+                    item_start = i
+            elif ch in "}]":
+                if ch == "}" and item_start is not None and depth == array_depth + 1:
+                    try:
+                        yield json.loads(buffer[item_start:i + 1])
+                    except ValueError:
+                        record_rejection("contextual_batch", "invalid_json")
+                    item_start = None
+                depth -= 1
+
+def iter_contextual_batch_llm(num_questions, exclude_words=(), model=None):
+    """Stream several contextual questions from one structured completion, yielding each valid one as it arrives
+
+    Yields (question, answer_line, target_word). With VERIFY_CHOICES the batch is
+    verified in one call once complete, so items are released together.
+    """
+    request = CONTEXTUAL_BATCH_INSTRUCTIONS.format(num_questions=num_questions).strip()
+    if exclude_words:
+        request += "\nلا تستخدم الكلمات المستهدفة التالية: " + "، ".join(exclude_words)
+    
+    try:
+        messages = build_messages(CONTEXTUAL_PROMPT, request, stage="contextual_batch")
+    except PromptBudgetExceeded:
+        # The caller moves on to the next round or the single-question path
+        record_rejection("contextual_batch", "prompt_budget")
+        return
+    
+    chunks = stream_chat_completion(
+        get_client(),
+        model=model or model_for("contextual_batch"),
+        messages=messages,
+        temperature=0.6,
+        max_tokens=CONTEXTUAL_BATCH_TOKENS_PER_QUESTION * num_questions,
+        response_format=CONTEXTUAL_BATCH_RESPONSE_FORMAT,
+    )
     
-    while len(questions) < num_questions and attempts < max_attempts:
+    verified_later = []
+    try:
+        for item in iter_json_array_items(chunks):
+            q, answer_line = validate_contextual_item(item)
+            if not (q and answer_line):
+                continue
+            if VERIFY_CHOICES:
+                verified_later.append((q, answer_line, item))
+            else:
+                yield q, answer_line, item["target_word"].strip()
+    except Exception as e:
+        # Keep whatever arrived before the stream failed
+        record_error("contextual_batch", e)
+    
+    if verified_later:
+        # One verification call for the whole batch; only distractors are judged out of context
+        choice_sets = [(item["target_word"], [str(c).strip() for c in item["choices"]]) for _, _, item in verified_later]
+        verdict_sets = verify_choice_sets(choice_sets)
+        for (q, answer_line, item), (_, choices), verdicts in zip(verified_later, choice_sets, verdict_sets):
+            correct_choice = choices[CHOICE_LETTERS.index(item["correct"])]
+            if choices_pass_verification(verdicts, correct_choice, require_correct=False):
+                yield q, answer_line, item["target_word"].strip()
+            else:
+                record_rejection("contextual_batch", "synonym_distractor")
+
+def generate_contextual_batch_llm(num_questions, exclude_words=()):
+    """Ask for several contextual questions in one structured completion; returns the valid ones"""
+    return list(iter_contextual_batch_llm(num_questions, exclude_words))
+
+def iter_contextual_test_llm(num_questions, reference_questions, grade, dedup=None):
+    """Yield (question, answer_line) tuples for a contextual test as soon as each one is validated
+
+    Target words and near-duplicate sentences already used in the test, or in
+    dedup's teacher/session scope, are rejected; used words are sent as an exclusion list.
+    """
+    dedup = dedup or DedupIndex(None, path=None)
+    produced = 0
+    models = escalation("contextual_batch")
+    
+    # Batch mode: each round only re-requests the items that failed validation, one tier up if there is one
+    for round_number in range(CONTEXTUAL_BATCH_MAX_ROUNDS):
+        missing = num_questions - produced
+        if missing <= 0 or deadline_expired():
+            break
+        model = models[min(round_number, len(models) - 1)]
+        if round_number and model != models[min(round_number - 1, len(models) - 1)]:
+            record_escalation("contextual_batch", models[round_number - 1], model)
+        for q, answer_line, target_word in iter_contextual_batch_llm(missing, dedup.excluded_words(), model):
+            if produced >= num_questions:
+                break
+            if not claim_contextual_question(dedup, q):
+                continue
+            produced += 1
+            yield q, answer_line
+    
+    # Single-question path for whatever the batch rounds could not produce
+    max_attempts = (num_questions - produced) * CONTEXTUAL_SINGLE_FALLBACK_ATTEMPTS
+    if max_attempts:
+        record_fallback("contextual_test", "single_question")
+    attempts = 0
+    while produced < num_questions and attempts < max_attempts and not deadline_expired():
         attempts += 1
         try:
-            q, answer_line = generate_mcq_contextual_word_meaning(reference_questions, grade)
-            if q and answer_line:
-                questions.append((q, answer_line))
+            q, answer_line = generate_mcq_contextual_word_meaning(
+                reference_questions, grade, exclude_words=dedup.excluded_words()
+            )
+            if q and answer_line and claim_contextual_question(dedup, q):
+                produced += 1
+                yield q, answer_line
         except Exception as e:
+            record_error("contextual_test", e)
             continue
-    
-    return questions
+
+def generate_contextual_test_llm(num_questions, reference_questions, grade, dedup=None):
+    return list(iter_contextual_test_llm(num_questions, reference_questions, grade, dedup))
 
 # Keep the old functions for backward compatibility
 def extract_contextual_mcq_parts(gpt_output):
@@ -677,12 +1428,11 @@ def enforce_al_in_context_choices(choices, underlined_word):
         return choices
     ensured = []
     for c in choices:
-        m = re.match(r'^([أ-د][\)\-]?)\s*(.+)', c)
-        if m:
-            label, word = m.group(1), m.group(2)
-            if not word.startswith("ال"):
+        label, word = split_choice_label(c)
+        if label:
+            if not has_al(word):
                 word = "ال" + word
-            ensured.append(f"{label} {word}")
+            ensured.append(f"{label}) {word}")
         else:
             ensured.append(c)
     return ensured
@@ -0,0 +1,90 @@
+import math
+import os
+from functools import lru_cache
+from metrics import count, registry
+
+# Input tokens allowed per call; optional example lines are dropped to stay under it
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", "3000"))
+
+# Chat format overhead per message and for priming the reply
+MESSAGE_OVERHEAD = 4
+REPLY_OVERHEAD = 3
+
+
+class PromptBudgetExceeded(ValueError):
+    """Raised when the fixed part of a prompt alone is over the input budget"""
+
+
+@lru_cache(maxsize=None)
+def _encoding(model):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text, model="gpt-4.1"):
+    """Exact count with tiktoken when installed, else about three characters per token (Arabic)"""
+    if not text:
+        return 0
+    encoding = _encoding(model)
+    if encoding is None:
+        return math.ceil(len(text) / 3)
+    return len(encoding.encode(text))
+
+
+def count_message_tokens(messages, model="gpt-4.1"):
+    return sum(count_tokens(m["content"], model) + MESSAGE_OVERHEAD for m in messages) + REPLY_OVERHEAD
+
+
+def build_messages(system, user, examples=(), examples_header="", model="gpt-4.1",
+                   budget=PROMPT_TOKEN_BUDGET, stage="prompt"):
+    """System prefix plus a user suffix, with as many example lines as fit the budget
+
+    system must not vary between calls; everything request-specific belongs in
+    user or examples. The provider only caches prefixes of 1024 tokens or more,
+    which the current system prompts do not reach.
+    """
+    messages = [{"role": "system", "content": system}, {"role": "user", "content": user}]
+    used = count_message_tokens(messages, model)
+    if used > budget:
+        raise PromptBudgetExceeded(f"{stage}: {used} input tokens over the budget of {budget}")
+
+    kept = []
+    trimmed = 0
+    if examples:
+        used += count_tokens("\n\n" + examples_header, model)
+        for example in examples:
+            cost = count_tokens("\n- " + example, model)
+            if used + cost <= budget:
+                kept.append(example)
+                used += cost
+            else:
+                trimmed += cost
+    if kept:
+        messages[1]["content"] = user + "\n\n" + examples_header + "".join("\n- " + example for example in kept)
+
+    count("prompt_input_tokens_total", used, stage=stage)
+    count("prompt_prefix_tokens_total", count_tokens(system, model), stage=stage)
+    if trimmed:
+        count("prompt_trimmed_tokens_total", trimmed, stage=stage)
+    return messages
+
+
+def token_report():
+    """Input tokens sent, the part sent as a stable prefix, and tokens saved by trimming and provider caching"""
+    totals = {"input": 0, "prefix": 0, "trimmed": 0}
+    names = {"prompt_input_tokens_total": "input", "prompt_prefix_tokens_total": "prefix", "prompt_trimmed_tokens_total": "trimmed"}
+    for (name, _), value in registry.counters():
+        if name in names:
+            totals[names[name]] += value
+    cached = sum(value for (name, labels), value in registry.counters()
+                 if name == "llm_tokens_total" and ("kind", "cached_prompt") in labels)
+    totals["provider_cached"] = cached
+    totals["saved"] = totals["trimmed"] + cached
+    return totals
@@ -1,21 +1,34 @@
 from openai_utils import (
     generate_mcq_arabic_word_meaning,
     generate_meaning_test_llm,
+    iter_meaning_test_llm,
     generate_mcq_contextual_word_meaning,
-    generate_contextual_test_llm
+    generate_contextual_test_llm,
+    iter_contextual_test_llm,
+    claim_meaning_question,
+    claim_contextual_question,
+    reshuffle_choices
 )
 
 # Word meaning MCQ
 def create_question(main_word, reference_questions, grade):
     return generate_mcq_arabic_word_meaning(main_word, reference_questions, grade)
 
-def generate_meaning_test(num_questions, reference_questions, grade):
-    return generate_meaning_test_llm(num_questions, reference_questions, grade)
+def generate_meaning_test(num_questions, reference_questions, grade, dedup=None):
+    return generate_meaning_test_llm(num_questions, reference_questions, grade, dedup)
 
-# Contextual word meaning MCQ (single)
-def generate_contextual_question(reference_questions, grade):
-    return generate_mcq_contextual_word_meaning(reference_questions, grade)
+# Yields each question as soon as it is ready
+def iter_meaning_test(num_questions, reference_questions, grade, dedup=None):
+    return iter_meaning_test_llm(num_questions, reference_questions, grade, dedup)
+
+# Contextual word meaning MCQ (single); on_token receives the text as it streams in
+def generate_contextual_question(reference_questions, grade, on_token=None, exclude_words=()):
+    return generate_mcq_contextual_word_meaning(reference_questions, grade, on_token, exclude_words)
 
 # Contextual word meaning MCQ (test)
-def generate_contextual_test(num_questions, reference_questions, grade):
-    return generate_contextual_test_llm(num_questions, reference_questions, grade)
+def generate_contextual_test(num_questions, reference_questions, grade, dedup=None):
+    return generate_contextual_test_llm(num_questions, reference_questions, grade, dedup)
+
+# Yields each contextual question as soon as it is validated
+def iter_contextual_test(num_questions, reference_questions, grade, dedup=None):
+    return iter_contextual_test_llm(num_questions, reference_questions, grade, dedup)
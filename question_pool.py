@@ -0,0 +1,235 @@
+import contextlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from llm_client import deadline, fresh_samples, ACTION_DEADLINE
+from reference_loader import load_reference_questions
+from question_generator import (
+    create_question,
+    generate_meaning_test,
+    generate_contextual_test
+)
+
+POOL_PATH = os.path.join(".cache", "question_pool.sqlite3")
+
+# Question types, as shown in the app's selectbox
+WORD_MEANING = "معنى الكلمة"
+MEANING_TEST = "اختبار معاني الكلمات (تلقائي)"
+CONTEXTUAL = "معنى الكلمة حسب السياق"
+
+# Refill when fewer than LOW_WATERMARK unserved questions remain, up to HIGH_WATERMARK
+LOW_WATERMARK = 5
+HIGH_WATERMARK = 15
+WORD_LOW_WATERMARK = 1
+WORD_HIGH_WATERMARK = 3
+REFILL_BATCH = 5
+REFILL_INTERVAL = 30.0
+
+# A word is prefetched once it has been requested WORD_PREFETCH_MIN_REQUESTS times; the least
+# recently requested beyond WORD_WATCH_MAX, and any not requested for WORD_WATCH_TTL, are dropped
+WORD_PREFETCH_MIN_REQUESTS = 2
+WORD_WATCH_MAX = 64
+WORD_WATCH_TTL = 60 * 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS questions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    grade_folder TEXT NOT NULL,
+    skill_folder TEXT NOT NULL,
+    question_type TEXT NOT NULL,
+    main_word TEXT NOT NULL DEFAULT '',
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    message TEXT,
+    created_at REAL NOT NULL,
+    served_at REAL,
+    UNIQUE (grade_folder, skill_folder, question_type, question)
+);
+CREATE INDEX IF NOT EXISTS idx_questions_unserved
+    ON questions (grade_folder, skill_folder, question_type, main_word, served_at);
+"""
+
+
+def extract_main_word(question):
+    """Main word of a formatted word-meaning question (ما معنى كلمة "...")"""
+    match = re.search(r'ما معنى كلمة "([^"]+)"', question or "")
+    return match.group(1) if match else ""
+
+
+class QuestionPool:
+    """SQLite bank of pre-generated questions keyed by grade folder, skill folder and question type"""
+
+    def __init__(self, path=POOL_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # One short-lived connection per operation keeps the pool safe to share across threads
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def add(self, grade_folder, skill_folder, question_type, items, main_word=""):
+        """Store (question, answer[, message]) tuples; duplicates of stored questions are ignored"""
+        now = time.time()
+        rows = []
+        for item in items:
+            question, answer = item[0], item[1]
+            message = item[2] if len(item) > 2 else None
+            if not question or not answer:
+                continue
+            word = main_word or (extract_main_word(question) if question_type != CONTEXTUAL else "")
+            rows.append((grade_folder, skill_folder, question_type, word, question, answer, message, now))
+        if not rows:
+            return 0
+        with self._connect() as conn:
+            conn.execute("BEGIN")
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO questions "
+                "(grade_folder, skill_folder, question_type, main_word, question, answer, message, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            conn.commit()
+            return conn.total_changes - before
+
+    def available(self, grade_folder, skill_folder, question_type, main_word=""):
+        """Number of unserved questions for a key, optionally restricted to one main word"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) FROM questions WHERE grade_folder = ? AND skill_folder = ? "
+                "AND question_type = ? AND served_at IS NULL"
+                + (" AND main_word = ?" if main_word else ""),
+                (grade_folder, skill_folder, question_type) + ((main_word,) if main_word else ()),
+            ).fetchone()
+        return row[0]
+
+    def take(self, grade_folder, skill_folder, question_type, count, main_word=""):
+        """Serve up to count unserved questions, oldest first, marking them served so they never repeat"""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT id, question, answer, message FROM questions WHERE grade_folder = ? "
+                "AND skill_folder = ? AND question_type = ? AND served_at IS NULL"
+                + (" AND main_word = ?" if main_word else "")
+                + " ORDER BY id LIMIT ?",
+                (grade_folder, skill_folder, question_type)
+                + ((main_word,) if main_word else ())
+                + (count,),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE questions SET served_at = ? WHERE id = ?",
+                [(time.time(), row[0]) for row in rows],
+            )
+            conn.commit()
+        return [(question, answer, message) for _, question, answer, message in rows]
+
+
+class PoolRefiller(threading.Thread):
+    """Background worker that keeps watched pool keys topped up with the generate_* functions"""
+
+    def __init__(self, pool, interval=REFILL_INTERVAL):
+        super().__init__(name="question-pool-refiller", daemon=True)
+        self.pool = pool
+        self.interval = interval
+        self._specs = {}
+        self._words = OrderedDict()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+
+    def watch(self, grade_folder, skill_folder, question_type, grade, main_word=""):
+        """Keep a key above its low watermark; grade is the label passed to the generators
+
+        Word keys are only refilled once requested repeatedly, and expire when no longer asked for.
+        """
+        key = (grade_folder, skill_folder, question_type, main_word)
+        if main_word:
+            self._watch_word(key, grade)
+            return
+        with self._lock:
+            if key in self._specs:
+                return
+            self._specs[key] = grade
+        self._wake.set()
+
+    def _watch_word(self, key, grade):
+        now = time.monotonic()
+        with self._lock:
+            _, requests, _ = self._words.pop(key, (grade, 0, now))
+            self._words[key] = (grade, requests + 1, now)
+            self._prune_words(now)
+        if requests + 1 == WORD_PREFETCH_MIN_REQUESTS:
+            self._wake.set()
+
+    def _prune_words(self, now):
+        while self._words:
+            oldest, (_, _, used_at) = next(iter(self._words.items()))
+            if len(self._words) <= WORD_WATCH_MAX and now - used_at <= WORD_WATCH_TTL:
+                break
+            del self._words[oldest]
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+    def run(self):
+        while not self._stopped.is_set():
+            self._wake.clear()
+            with self._lock:
+                self._prune_words(time.monotonic())
+                specs = list(self._specs.items()) + [
+                    (key, grade)
+                    for key, (grade, requests, _) in self._words.items()
+                    if requests >= WORD_PREFETCH_MIN_REQUESTS
+                ]
+            for key, grade in specs:
+                if self._stopped.is_set():
+                    break
+                try:
+                    self._refill(key, grade)
+                except Exception:
+                    # A failed refill must not kill the worker; the next cycle retries
+                    continue
+            self._wake.wait(self.interval)
+
+    def _refill(self, key, grade):
+        grade_folder, skill_folder, question_type, main_word = key
+        low, high = (WORD_LOW_WATERMARK, WORD_HIGH_WATERMARK) if main_word else (LOW_WATERMARK, HIGH_WATERMARK)
+        available = self.pool.available(*key)
+        if available >= low:
+            return
+        reference_questions = load_reference_questions(grade_folder, skill_folder)
+        if not reference_questions:
+            return
+        while available < high and not self._stopped.is_set():
+            batch = min(REFILL_BATCH, high - available)
+            # Cached answers would only come back as reshuffles of questions already in the pool
+            with deadline(ACTION_DEADLINE), fresh_samples():
+                items = self._generate(question_type, batch, reference_questions, grade, main_word)
+            added = self.pool.add(grade_folder, skill_folder, question_type, items, main_word)
+            if not added:
+                break
+            available += added
+
+    def _generate(self, question_type, batch, reference_questions, grade, main_word):
+        if question_type == WORD_MEANING:
+            return [create_question(main_word, reference_questions, grade)]
+        if question_type == MEANING_TEST:
+            return generate_meaning_test(batch, reference_questions, grade)
+        return generate_contextual_test(batch, reference_questions, grade)
@@ -0,0 +1,124 @@
+import math
+import re
+import threading
+import numpy as np
+from arabic_text import letters_only
+
+NGRAM_SIZES = (2, 3, 4)
+MIN_WORDS = 2
+MAX_LINE_LENGTH = 300
+# Cosine similarity below which a line shares too little with the query to help
+MIN_SCORE = 0.1
+
+# Page numbers, test titles and instructions that make poor few-shot examples
+_NOISE = re.compile(r"صفحة|اختبار|الكتيب|مستوى|اختر|تعليمات")
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def char_ngrams(text):
+    grams = []
+    for word in text.split():
+        padded = f" {word} "
+        for n in NGRAM_SIZES:
+            grams.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+    return grams
+
+
+def _is_example(line, normalized):
+    return (
+        len(normalized.split()) >= MIN_WORDS
+        and len(line) <= MAX_LINE_LENGTH
+        and not _NOISE.search(normalized)
+    )
+
+
+class ReferenceIndex:
+    """Character n-gram TF-IDF over the reference lines, stored as per-n-gram postings"""
+
+    def __init__(self, lines):
+        self.lines = []
+        self._vocabulary = {}
+        rows = []
+        seen = set()
+        for line in lines:
+            line = line.strip()
+            normalized = letters_only(line)
+            if normalized in seen or not _is_example(line, normalized):
+                continue
+            seen.add(normalized)
+            counts = {}
+            for gram in char_ngrams(normalized):
+                term = self._vocabulary.setdefault(gram, len(self._vocabulary))
+                counts[term] = counts.get(term, 0) + 1
+            self.lines.append(line)
+            rows.append(counts)
+
+        self.size = len(self.lines)
+        document_frequency = np.zeros(len(self._vocabulary))
+        for counts in rows:
+            document_frequency[list(counts)] += 1
+        self._idf = np.log((1 + self.size) / (1 + document_frequency)) + 1
+
+        # Postings grouped by term (CSC layout): docs and weights of term t live in [indptr[t], indptr[t + 1])
+        postings = [[] for _ in self._vocabulary]
+        for doc, counts in enumerate(rows):
+            weights = {term: (1 + math.log(tf)) * self._idf[term] for term, tf in counts.items()}
+            norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+            for term, weight in weights.items():
+                postings[term].append((doc, weight / norm))
+        self._indptr = np.zeros(len(postings) + 1, dtype=np.int64)
+        self._indptr[1:] = np.cumsum([len(p) for p in postings])
+        self._docs = np.fromiter((doc for p in postings for doc, _ in p), dtype=np.int64, count=self._indptr[-1])
+        self._weights = np.fromiter((w for p in postings for _, w in p), dtype=np.float64, count=self._indptr[-1])
+
+    def _query_vector(self, text):
+        counts = {}
+        for gram in char_ngrams(letters_only(text)):
+            term = self._vocabulary.get(gram)
+            if term is not None:
+                counts[term] = counts.get(term, 0) + 1
+        if not counts:
+            return None, None
+        terms = np.fromiter(counts, dtype=np.int64, count=len(counts))
+        weights = (1 + np.log(np.fromiter(counts.values(), dtype=np.float64, count=len(counts)))) * self._idf[terms]
+        return terms, weights / np.linalg.norm(weights)
+
+    def scores(self, text):
+        """Cosine similarity of text against every indexed line"""
+        terms, weights = self._query_vector(text)
+        if terms is None or not self.size:
+            return np.zeros(self.size)
+        starts, ends = self._indptr[terms], self._indptr[terms + 1]
+        lengths = ends - starts
+        positions = np.repeat(ends - lengths.cumsum(), lengths) + np.arange(lengths.sum())
+        return np.bincount(self._docs[positions], weights=self._weights[positions] * np.repeat(weights, lengths),
+                           minlength=self.size)
+
+    def top_k(self, text, k=3, min_score=MIN_SCORE):
+        """The k lines most similar to text, best first; lines scoring under min_score are left out"""
+        scores = self.scores(text)
+        k = min(k, int(np.count_nonzero(scores >= min_score)))
+        if not k:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        return [self.lines[i] for i in best[np.argsort(-scores[best])]]
+
+
+def get_reference_index(reference_questions):
+    """Index for a corpus, built once per corpus version"""
+    version = getattr(reference_questions, "version", None) or hash(tuple(reference_questions))
+    with _indexes_lock:
+        index = _indexes.get(version)
+        if index is None:
+            index = ReferenceIndex(reference_questions)
+            _indexes[version] = index
+        return index
+
+
+def select_examples(reference_questions, query, k=3):
+    """Few-shot examples for a request: the k reference lines closest to query"""
+    if not reference_questions:
+        return []
+    return get_reference_index(reference_questions).top_k(query, k)
@@ -1,21 +1,212 @@
 import os
+import hashlib
+import multiprocessing
+import pickle
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from docx import Document
 import PyPDF2
+from metrics import annotate, count, span
 
-def load_reference_questions(grade, skill):
-    folder_path = os.path.join("data", grade, skill)
-    questions = []
+# On-disk index of parsed reference files: path -> (size, mtime_ns, digest, lines)
+CACHE_PATH = os.path.join(".cache", "reference_corpus.pkl")
+
+# PDFs are split into page ranges of this size; a process pool is used once there are enough ranges/files
+PDF_PAGES_PER_TASK = 20
+PARALLEL_MIN_TASKS = 3
+EXTRACT_MAX_WORKERS = max(1, min(8, (os.cpu_count() or 2) - 1))
+
+_cache_lock = threading.Lock()
+_index_lock = threading.Lock()
+_file_index = None
+_corpus_cache = {}
+
+
+class ReferenceCorpus(list):
+    """List of reference lines tagged with a version that changes when any source file changes"""
+
+    def __init__(self, lines, version):
+        super().__init__(lines)
+        self.version = version
+
+
+def _parse_docx(path):
+    doc = Document(path)
+    return [para.text.strip() for para in doc.paragraphs if para.text.strip()]
+
+
+def _parse_pdf_pages(path, start=0, stop=None):
+    lines = []
+    with open(path, "rb") as f:
+        reader = PyPDF2.PdfReader(f)
+        for page in reader.pages[start:stop]:
+            text = page.extract_text()
+            if text:
+                lines.extend([line for line in text.split("\n") if line.strip()])
+    return lines
+
+
+def _parse_pdf(path):
+    return _parse_pdf_pages(path)
+
+
+def _parse_file(path):
+    if path.endswith(".docx"):
+        return _parse_docx(path)
+    return _parse_pdf(path)
+
+
+def _extract(task):
+    """Run one extraction task (a DOCX file or a PDF page range); executed in a worker process"""
+    path, start, stop = task
+    if start is None:
+        return _parse_file(path)
+    return _parse_pdf_pages(path, start, stop)
+
+
+def _extraction_tasks(path):
+    if path.endswith(".docx"):
+        return [(path, None, None)]
+    with open(path, "rb") as f:
+        page_count = len(PyPDF2.PdfReader(f).pages)
+    return [(path, start, min(start + PDF_PAGES_PER_TASK, page_count))
+            for start in range(0, page_count, PDF_PAGES_PER_TASK)] or [(path, None, None)]
+
+
+def _file_digest(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _load_index():
+    global _file_index
+    if _file_index is None:
+        try:
+            with open(CACHE_PATH, "rb") as f:
+                _file_index = pickle.load(f)
+        except Exception:
+            # Missing or unreadable index: start empty and rebuild on demand
+            _file_index = {}
+    return _file_index
+
+
+def _save_index(index):
+    try:
+        os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+        tmp_path = CACHE_PATH + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, CACHE_PATH)
+    except OSError:
+        # The disk tier is best effort; the in-memory cache still applies
+        pass
+
+
+def _list_reference_files(folder_path):
+    entries = []
     for filename in os.listdir(folder_path):
-        if filename.endswith(".docx"):
-            doc = Document(os.path.join(folder_path, filename))
-            for para in doc.paragraphs:
-                if para.text.strip():
-                    questions.append(para.text.strip())
-        elif filename.endswith(".pdf"):
-            with open(os.path.join(folder_path, filename), "rb") as f:
-                reader = PyPDF2.PdfReader(f)
-                for page in reader.pages:
-                    text = page.extract_text()
-                    if text:
-                        questions.extend([line for line in text.split("\n") if line.strip()])
-    return questions
+        if filename.endswith(".docx") or filename.endswith(".pdf"):
+            path = os.path.join(folder_path, filename)
+            stat = os.stat(path)
+            entries.append((path, stat.st_size, stat.st_mtime_ns))
+    return tuple(entries)
+
+
+def _plan_corpus(signature):
+    """Per file (path, size, mtime_ns, digest, lines or None when it must be parsed), and the corpus version"""
+    with _index_lock:
+        index = dict(_load_index())
+    plan = []
+    for path, size, mtime_ns in signature:
+        entry = index.get(path)
+        if entry and entry[0] == size and entry[1] == mtime_ns:
+            plan.append((path, size, mtime_ns, entry[2], entry[3]))
+            continue
+        digest = _file_digest(path)
+        parsed = entry[3] if entry and entry[2] == digest else None
+        plan.append((path, size, mtime_ns, digest, parsed))
+    version = hashlib.sha1("\n".join(item[3] for item in plan).encode("utf-8")).hexdigest()
+    return plan, version
+
+
+def _iter_planned_lines(folder_path, plan, progress=None):
+    """Yield the corpus lines in file order, extracting unparsed files on a process pool
+
+    progress(done, total) is called after each extraction task (a DOCX file or a
+    PDF page range) completes; it is not called when every file is cached.
+    """
+    tasks = {path: _extraction_tasks(path) for path, _, _, _, parsed in plan if parsed is None}
+    total = sum(len(file_tasks) for file_tasks in tasks.values())
+    executor = None
+    if total >= PARALLEL_MIN_TASKS:
+        executor = ProcessPoolExecutor(
+            max_workers=min(EXTRACT_MAX_WORKERS, total),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    try:
+        # Submit everything up front so workers run ahead while earlier files are consumed
+        pending = {
+            path: [executor.submit(_extract, task) for task in file_tasks] if executor else file_tasks
+            for path, file_tasks in tasks.items()
+        }
+        done = 0
+        updates = {}
+        for path, size, mtime_ns, digest, parsed in plan:
+            if parsed is None:
+                file_lines = []
+                for job in pending[path]:
+                    part = job.result() if executor else _extract(job)
+                    file_lines.extend(part)
+                    yield from part
+                    done += 1
+                    if progress:
+                        progress(done, total)
+                parsed = tuple(file_lines)
+            else:
+                yield from parsed
+            updates[path] = (size, mtime_ns, digest, parsed)
+    finally:
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    with _index_lock:
+        index = _load_index()
+        changed = False
+        for path, entry in updates.items():
+            if index.get(path, ())[:3] != entry[:3]:
+                index[path] = entry
+                changed = True
+        prefix = folder_path + os.sep
+        for stale in [p for p in index if p.startswith(prefix) and p not in updates]:
+            del index[stale]
+            changed = True
+        if changed:
+            _save_index(index)
+
+    count("reference_files_parsed_total", len(tasks))
+    annotate(files=len(plan), files_parsed=len(tasks), extraction_tasks=total)
+
+
+def _build_corpus(folder_path, signature, progress=None):
+    """Assemble the corpus for a folder, re-parsing only files whose size/mtime and content changed"""
+    plan, version = _plan_corpus(signature)
+    return ReferenceCorpus(_iter_planned_lines(folder_path, plan, progress), version)
+
+
+def load_reference_questions(grade, skill, progress=None):
+    """The reference corpus of a grade/skill folder; progress(done, total) reports extraction work"""
+    folder_path = os.path.join("data", grade, skill)
+    with span("load_reference_questions", folder=folder_path) as current:
+        signature = _list_reference_files(folder_path)
+        with _cache_lock:
+            cached = _corpus_cache.get(folder_path)
+            if cached and cached[0] == signature:
+                current.set(cache="hit", lines=len(cached[1]))
+                return cached[1]
+            corpus = _build_corpus(folder_path, signature, progress)
+            _corpus_cache[folder_path] = (signature, corpus)
+            current.set(cache="miss", lines=len(corpus))
+            return corpus
@@ -0,0 +1,133 @@
+import contextlib
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_MAX_ENTRIES = 2048
+CACHE_TTL = 24 * 60 * 60
+# Distinct completions kept per key when temperature > 0
+CACHE_VARIANTS = 4
+
+_DISK_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT NOT NULL,
+    content TEXT NOT NULL,
+    stored_at REAL NOT NULL,
+    PRIMARY KEY (key, content)
+);
+"""
+
+
+def make_cache_key(model, messages, temperature, max_tokens, **kwargs):
+    payload = json.dumps(
+        [model, messages, temperature, max_tokens, kwargs],
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """LRU + TTL cache of completion texts with an optional SQLite tier
+
+    Deterministic calls (temperature 0) keep one completion per key. Sampled
+    calls keep a pool of up to `variants` completions and count as misses
+    until the pool is full, after which a random variant is served.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL, variants=CACHE_VARIANTS, disk_path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.variants = variants
+        self.disk_path = disk_path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if disk_path:
+            directory = os.path.dirname(disk_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self._connect() as conn:
+                conn.executescript(_DISK_SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.disk_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _pool_size(self, temperature):
+        return 1 if not temperature else self.variants
+
+    def _load_from_disk(self, key, now):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT content, stored_at FROM responses WHERE key = ? AND stored_at >= ? ORDER BY stored_at",
+                (key, now - self.ttl),
+            ).fetchall()
+        if not rows:
+            return None
+        return (rows[0][1], [content for content, _ in rows])
+
+    def get(self, key, temperature):
+        """Cached content for key, or None when the caller should go to the model"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None and self.disk_path:
+                entry = self._load_from_disk(key, now)
+                if entry:
+                    self._entries[key] = entry
+            if entry and len(entry[1]) >= self._pool_size(temperature):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return random.choice(entry[1])
+            self.misses += 1
+            return None
+
+    def put(self, key, content, temperature):
+        now = time.time()
+        with self._lock:
+            stored_at, variants = self._entries.get(key, (now, []))
+            if len(variants) >= self._pool_size(temperature):
+                return
+            variants = variants + [content]
+            self._entries[key] = (stored_at, variants)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            if self.disk_path:
+                with self._connect() as conn:
+                    conn.execute(
+                        "INSERT OR IGNORE INTO responses (key, content, stored_at) VALUES (?, ?, ?)",
+                        (key, content, now),
+                    )
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
@@ -0,0 +1,47 @@
+from llm_client import ACTION_DEADLINE, HTTP_KEEPALIVE_EXPIRY, HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE
+
+
+class ServiceError(Exception):
+    """The generation service answered with an error status"""
+
+
+class GenerationServiceClient:
+    """Thin blocking client for generation_service on a pooled keep-alive connection
+
+    Methods return the same tuples as the question_generator functions.
+    """
+
+    def __init__(self, base_url, timeout=ACTION_DEADLINE + 10):
+        import httpx
+
+        self._http = httpx.Client(
+            base_url=base_url.rstrip("/"),
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            timeout=timeout,
+        )
+
+    def _post(self, path, payload):
+        response = self._http.post(path, json=payload)
+        data = response.json()
+        if response.status_code != 200:
+            raise ServiceError(f"{path}: {response.status_code} {data.get('error', '')}")
+        return data
+
+    def word_meaning(self, word):
+        data = self._post("/v1/word-meaning", {"word": word})
+        return data["question"], data["answer"], data["message"]
+
+    def meaning_test(self, num_questions, scope=None):
+        data = self._post("/v1/meaning-test", {"num_questions": num_questions, "scope": scope})
+        return [(item["question"], item["answer"], item["message"]) for item in data["questions"]]
+
+    def contextual_test(self, num_questions, scope=None):
+        data = self._post("/v1/contextual-test", {"num_questions": num_questions, "scope": scope})
+        return [(item["question"], item["answer"]) for item in data["questions"]]
+
+    def close(self):
+        self._http.close()
@@ -0,0 +1,64 @@
+import threading
+from llm_client import DeadlineExceeded, time_remaining
+from metrics import count, gauge, registry
+
+_groups = set()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Process-wide coalescing: concurrent calls with the same key share one execution
+
+    The first caller for a key (the leader) runs fn; callers arriving while
+    it is in flight wait for its result instead of repeating the work.
+    Nothing is cached once the call completes.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        _groups.add(name)
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """Return (result, shared); shared is True for callers that received the leader's result"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        count("single_flight_calls_total", group=self.name, role="leader" if leader else "follower")
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as exc:
+                call.error = exc
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+            return call.result, False
+
+        if not call.done.wait(time_remaining()):
+            raise DeadlineExceeded("action deadline reached while waiting for a coalesced request")
+        if call.error is not None:
+            raise call.error
+        return call.result, True
+
+
+def coalescing_ratio(name):
+    """Share of calls in a group that were answered by another caller's in-flight request"""
+    leaders = registry.value("single_flight_calls_total", group=name, role="leader")
+    followers = registry.value("single_flight_calls_total", group=name, role="follower")
+    total = leaders + followers
+    return followers / total if total else 0.0
+
+
+gauge("single_flight_coalescing_ratio", lambda: [({"group": name}, coalescing_ratio(name)) for name in sorted(_groups)])